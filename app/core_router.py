@@ -1,6 +1,7 @@
+import asyncio
 from typing import List, Optional
 
-from fastapi import APIRouter, BackgroundTasks, File, Query, UploadFile
+from fastapi import APIRouter, File, Query, UploadFile
 from fastapi.responses import FileResponse
 
 from utils.db_utils import (
@@ -16,7 +17,8 @@ from utils.file_manager import (
     remove_pdf_files,
     store_pdf,
 )
-from utils.vector_utils import DEFAULT_EMBEDDING_MODEL, extract_embed_n_save
+from utils.ingest_queue import enqueue_ingest
+from utils.vector_utils import DEFAULT_EMBEDDING_MODEL
 
 core_router = APIRouter(prefix="/core", tags=["core"])
 
@@ -26,6 +28,15 @@ def list_uploaded_pdfs():
     return list_pdfs()
 
 
+# Peak memory per upload is one read of this size, not the whole PDF
+UPLOAD_READ_SIZE = 1 << 20
+
+
+async def _iter_upload(file: UploadFile):
+    while chunk := await file.read(UPLOAD_READ_SIZE):
+        yield chunk
+
+
 @core_router.post("/upload-pdf")
 async def upload_pdf(
     file: UploadFile = File(...),
@@ -33,13 +44,17 @@ async def upload_pdf(
     embedding_model: Optional[str] = Query(
         DEFAULT_EMBEDDING_MODEL, description="SentenceTransformer model name"
     ),
-    background_tasks: BackgroundTasks = None,
 ):
-    file_bytes = await file.read()
-    pdf_path = store_pdf(file_bytes, file.filename)
-    background_tasks.add_task(
-        extract_embed_n_save, pdf_path, chunk_size, embedding_model, file.filename
-    )
+    # Ingest runs in another process, and questions are always embedded with
+    # the default model, so PDFs embedded with any other model couldn't be
+    # searched. Accept only the default until the model is stored per PDF.
+    if embedding_model and embedding_model != DEFAULT_EMBEDDING_MODEL:
+        return {
+            "error": f"Only the default embedding model ({DEFAULT_EMBEDDING_MODEL}) is supported"
+        }
+    embedding_model = DEFAULT_EMBEDDING_MODEL
+    pdf_path = await store_pdf(_iter_upload(file), file.filename)
+    await enqueue_ingest(pdf_path, chunk_size, embedding_model, file.filename)
     return {
         "filename": file.filename,
         "status": "uploaded",
@@ -79,6 +94,8 @@ def remove_pdf(
 
     # Get org ID
     org_id = get_or_create_org(org_name)
+    if org_id is None:
+        return {"error": f"Org '{org_name}' is inactive"}
 
     # Remove database records
     db_result = remove_pdf_data(filename, org_id)
@@ -118,11 +135,11 @@ def clean_chunks():
 
 
 @core_router.get("/get-pdf-text")
-def get_pdf_text(filename: str = Query(...)):
+async def get_pdf_text(filename: str = Query(...)):
     pdf_path = fetch_pdf(filename)
     if not pdf_path:
         return {"error": "File not found"}
-    text = extract_text_from_pdf(pdf_path)
+    text = await asyncio.to_thread(extract_text_from_pdf, pdf_path)
     preview = preview_lines(text, n=5)
     return {
         "filename": filename,
@@ -2,10 +2,18 @@ from fastapi import FastAPI
 from app.core_router import core_router
 from app.v1_router import v1_router
 from app.v2_router import v2_router
+from utils.vector_utils import get_embedder
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+def load_embedder():
+    # Runs once per worker process, so each worker has its model ready
+    # before serving its first question
+    get_embedder()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -1,14 +1,185 @@
+import asyncio
+import os
+import threading
+
+import numpy as np
 from fastapi import APIRouter, Query
-from utils.vector_utils import get_embedder
-from utils.file_manager import list_pdfs, read_cleaned_chunks_and_vectors
-from utils.llm_utils import generate_llm_answer
-from utils.vector_utils import cosine_sim, get_top_k_indices
+from utils.vector_utils import cosine_sim_batch, get_embedder, get_top_k_indices
+from utils.file_manager import (
+    fetch_vectors,
+    list_pdfs,
+    read_cleaned_chunks_and_vectors,
+)
+from utils.llm_utils import generate_llm_answer_async
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
 
 v1_router = APIRouter(prefix="/v1")
 
+# (pdf, chunk_size, overlap) -> (vector file mtime, chunks, matrix, row norms or None)
+_PDF_MATRIX_CACHE = {}
+# (key, corpus) over every loaded PDF, rebuilt whenever any PDF's vectors change.
+# Swapped as one tuple so concurrent requests always see a consistent snapshot.
+_CORPUS_CACHE = (None, None)
+# Held while a corpus is rebuilt, so concurrent questions after a PDF change
+# wait for one index build instead of each building their own
+_CORPUS_LOCK = threading.Lock()
+
+
+def _load_pdf_matrix(pdf: str, chunk_size: int, overlap: int):
+    """
+    Return (mtime, chunks, matrix, norms) for a PDF. float32 unit-norm files
+    are used as-is (norms is None), so a query only pays for the dot product;
+    int8/float16 files stay compact on their memory-map with per-row norms
+    cached.
+    Entries are keyed on the vector file's mtime, so a re-upload of the same
+    filename invalidates them.
+    """
+    vector_path = fetch_vectors(os.path.splitext(pdf)[0] + ".npy")
+    if not vector_path:
+        return None
+    try:
+        mtime = os.path.getmtime(vector_path)
+    except FileNotFoundError:
+        # fetch_vectors' existence check is cached briefly; removed meanwhile
+        return None
+    key = (pdf, chunk_size, overlap)
+    cached = _PDF_MATRIX_CACHE.get(key)
+    if cached and cached[0] == mtime:
+        return cached
+    result = read_cleaned_chunks_and_vectors(
+        pdf, chunk_size=chunk_size, overlap=overlap
+    )
+    if not result:
+        return None
+    chunks, vectors = result
+    if vectors.dtype in (np.int8, np.float16):
+        # Cosine is scale-invariant, so compact rows are scored directly and
+        # only their own norms are needed, never the quantization scales
+        matrix = vectors
+        norms = np.linalg.norm(matrix.astype(np.float32), axis=1)
+    else:
+        # Vectors embedded at ingest are already float32 and unit-norm, so the
+        # memory-map is used as-is; older files get a normalized private copy.
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        if not np.allclose(norms, 1.0, atol=1e-3):
+            matrix = matrix / (norms + 1e-8)
+        norms = None
+    _PDF_MATRIX_CACHE[key] = (mtime, chunks, matrix, norms)
+    return _PDF_MATRIX_CACHE[key]
+
+
+def _load_corpus(pdfs, chunk_size: int, overlap: int) -> dict:
+    """
+    Collect every PDF's (memory-mapped) matrix as a scoring segment with
+    parallel chunk/source lists, plus a FAISS HNSW index over the stacked
+    rows when faiss is installed. Reused across questions until a PDF is
+    added or re-embedded.
+    """
+    global _CORPUS_CACHE
+    # Drop matrices of PDFs that were removed since the last question, so
+    # the per-PDF cache never outgrows the current corpus
+    live = set(pdfs)
+    for key in list(_PDF_MATRIX_CACHE):
+        if key[0] not in live:
+            _PDF_MATRIX_CACHE.pop(key, None)
+    loaded = []
+    for pdf in pdfs:
+        result = _load_pdf_matrix(pdf, chunk_size, overlap)
+        if not result:
+            print(f"WARNING!!! no chunks or vectors found {pdf}")
+            continue
+        loaded.append((pdf, *result))
+    key = (chunk_size, overlap, tuple((pdf, mtime) for pdf, mtime, *_ in loaded))
+    cached_key, cached_corpus = _CORPUS_CACHE
+    if cached_key == key:
+        return cached_corpus
+    with _CORPUS_LOCK:
+        cached_key, cached_corpus = _CORPUS_CACHE
+        if cached_key == key:
+            # Built by another request while this one waited
+            return cached_corpus
+        corpus = _build_corpus(loaded)
+        _CORPUS_CACHE = (key, corpus)
+    return corpus
+
+
+def _build_corpus(loaded) -> dict:
+    """Segments, chunk/source lists and the FAISS index over loaded PDF matrices."""
+    segments = []
+    chunks_all = []
+    sources = []
+    for pdf, _, chunks, matrix, norms in loaded:
+        segments.append((len(chunks_all), matrix, norms))
+        chunks_all.extend(chunks)
+        sources.extend([pdf] * len(chunks))
+
+    index = None
+    if faiss is not None and segments:
+        rows = np.vstack(
+            [
+                m if n is None else m.astype(np.float32) / (n[:, None] + 1e-8)
+                for _, m, n in segments
+            ]
+        ).astype(np.float32)
+        dim = rows.shape[1]
+        dtypes = {m.dtype for _, m, _ in segments}
+        if dtypes & {np.dtype(np.int8), np.dtype(np.float16)}:
+            # Compact on disk: keep the index's copy at the same precision
+            qtype = (
+                faiss.ScalarQuantizer.QT_8bit
+                if np.dtype(np.int8) in dtypes
+                else faiss.ScalarQuantizer.QT_fp16
+            )
+            index = faiss.IndexHNSWSQ(dim, qtype, 32, faiss.METRIC_INNER_PRODUCT)
+            index.train(rows)
+        else:
+            index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.add(rows)
+
+    corpus = {
+        "segments": segments,
+        "chunks": chunks_all,
+        "sources": sources,
+        "index": index,
+    }
+    return corpus
+
+
+def _retrieve(question: str, top_k: int, chunk_size: int, overlap: int):
+    """Embed the question and return (chunks, sources, top_indices) over the corpus."""
+    q_vec = np.asarray(get_embedder().embed([question])[0], dtype=np.float32)
+    corpus = _load_corpus(list_pdfs(), chunk_size, overlap)
+    all_chunks = corpus["chunks"]
+    if not all_chunks:
+        return all_chunks, corpus["sources"], []
+
+    q_vec /= np.linalg.norm(q_vec) + 1e-8
+    k = min(top_k, len(all_chunks))
+    if k <= 0:
+        # faiss asserts on k <= 0
+        return all_chunks, corpus["sources"], []
+    if corpus["index"] is not None:
+        _, ids = corpus["index"].search(q_vec[None, :], k)
+        top_indices = [i for i in ids[0].tolist() if i >= 0]
+    else:
+        # Score each PDF's segment straight into one preallocated buffer, so
+        # nothing is concatenated or copied into memory per question.
+        sims = np.empty(len(all_chunks), dtype=np.float32)
+        for offset, matrix, norms in corpus["segments"]:
+            cosine_sim_batch(
+                q_vec, matrix, norms=norms, out=sims[offset : offset + len(matrix)]
+            )
+        top_indices = get_top_k_indices(sims, k)
+    return all_chunks, corpus["sources"], top_indices
+
 
 @v1_router.post("/ask")
-def ask_question(
+async def ask_question(
     question: str = Query(..., description="Your question about the PDF"),
     top_k: int = Query(3, description="Number of top chunks to use as context"),
     chunk_size: int = Query(200, description="Words per chunk (advanced chunking)"),
@@ -16,34 +187,20 @@ def ask_question(
         30, description="Words to overlap between chunks (advanced chunking)"
     ),
 ):
-    pdfs = list_pdfs()
-    if not pdfs:
+    if not list_pdfs():
         return {"error": "No PDFs available."}
-    q_vec = get_embedder().embed([question])[0]
-    all_chunks = []
-    all_embeddings = []
-    chunk_sources = []
-    for pdf in pdfs:
-        result = read_cleaned_chunks_and_vectors(
-            pdf, chunk_size=chunk_size, overlap=overlap
-        )
-        if not result:
-            print(f"WARNING!!! no chunks or vectors found {pdf}")
-            continue
-        chunks, vectors = result
-        all_chunks.extend(chunks)
-        all_embeddings.extend(vectors)
-        chunk_sources.extend([pdf] * len(chunks))
-    if not all_chunks or not all_embeddings:
+    # Embedding and disk-backed retrieval block, so keep them off the event loop
+    all_chunks, chunk_sources, top_indices = await asyncio.to_thread(
+        _retrieve, question, top_k, chunk_size, overlap
+    )
+    if not all_chunks:
         return {"error": "No chunks or embeddings found for selected PDFs."}
-    sims = [cosine_sim(q_vec, emb) for emb in all_embeddings]
-    top_indices = get_top_k_indices(sims, top_k)
     context = "\n\n".join(
         [f"[{chunk_sources[i]}] {all_chunks[i]}" for i in top_indices]
     )
     prompt = f"""Context:\n{context}\n\nQuestion: {question}\nAnswer:"""
     try:
-        answer = generate_llm_answer(prompt)
+        answer = await generate_llm_answer_async(prompt)
         return {
             "answer": answer,
             # "context_chunks": [all_chunks[i] for i in top_indices],
@@ -1,13 +1,34 @@
 import time
 
+import numpy as np
 from fastapi import APIRouter, Query
 
-from utils.db_utils import get_db_conn, get_or_create_org
+from utils.db_utils import (
+    execute_prepared,
+    get_corpus_generation,
+    get_db_conn,
+    inner_product_expr,
+    release_db_conn,
+    set_ef_search,
+)
 from utils.llm_utils import generate_llm_answer
+from utils.semcache import ANSWER_CACHE
 from utils.vector_utils import get_embedder
 
 v2_router = APIRouter(prefix="/v2")
 
+# Prepared once per pooled connection: (query vector, org name, top_k).
+# {distance} is filled in per server so the search matches the HNSW index.
+ASK_SQL = """
+    SELECT c.text, p.filename, {distance} AS distance
+    FROM chunks c
+    JOIN pdfs p ON c.pdf_id = p.id
+    JOIN orgs o ON p.org_id = o.id
+    WHERE o.name = $2 AND o.is_active = TRUE AND p.is_active = TRUE
+    ORDER BY distance ASC
+    LIMIT $3
+"""
+
 
 @v2_router.post("/ask_ai")
 def ask_ai(
@@ -17,46 +38,51 @@ def ask_ai(
     embedder = get_embedder()
     q_vec = embedder.embed([question])[0]
     start_time = time.time()
+    try:
+        # Other workers and the ingest processes change the corpus too, so
+        # the local cache is checked against the DB's generation counter
+        generation = get_corpus_generation()
+    except Exception as e:
+        return {"error": str(e)}
+    cached = ANSWER_CACHE.get(q_vec, key=top_k, generation=generation)
+    if cached is not None:
+        return cached
     conn = get_db_conn()
     try:
+        set_ef_search(conn)
         with conn:
             with conn.cursor() as cur:
-                org_id = get_or_create_org("default")
-                cur.execute(
-                    "SELECT id FROM pdfs WHERE org_id=%s AND is_active=TRUE",
-                    (org_id,),
-                )
-                pdf_ids = [row[0] for row in cur.fetchall()]
-                if not pdf_ids:
-                    return {"error": "No PDFs found for org."}
-                q_vec_str = "[" + ",".join(str(float(x)) for x in q_vec) + "]"
-                cur.execute(
-                    """
-                    SELECT c.text, p.filename, c.embedding <#> %s::vector AS distance
-                    FROM chunks c
-                    JOIN pdfs p ON c.pdf_id = p.id
-                    ORDER BY distance ASC
-                    LIMIT %s
-                """,
-                    (q_vec_str, top_k),
+                # Org and active-PDF filtering happen in the same query as the
+                # vector search, so there is a single round-trip per question
+                execute_prepared(
+                    cur,
+                    "ask_stmt",
+                    ASK_SQL.format(distance=inner_product_expr(cur, "$1")),
+                    (np.asarray(q_vec, dtype=np.float32), "default", top_k),
                 )
                 rows = cur.fetchall()
-                if not rows:
-                    return {"error": "No relevant context found."}
-                context = "\n\n".join(
-                    [f"[{filename}] says {text}" for text, filename, _ in rows]
-                )
-                sources = list(set([filename for _, filename, _ in rows]))
-                prompt = f"""Context:\n{context}\n\nQuestion: {question}\nAnswer:"""
-                answer = generate_llm_answer(prompt)
-                end_time = time.time()
-                print(f"Time taken to ask_ai: {end_time - start_time} seconds")
-                return {
-                    "answer": answer,
-                    "context_chunks": [row[0] for row in rows],
-                    "sources": sources,
-                }
     except Exception as e:
         return {"error": str(e)}
     finally:
-        conn.close()
+        # Released before the LLM call, so a slow answer doesn't hold a pooled
+        # connection (and an open transaction) for its whole duration
+        release_db_conn(conn)
+
+    if not rows:
+        return {"error": "No PDFs found for org."}
+    context = "\n\n".join([f"[{filename}] says {text}" for text, filename, _ in rows])
+    sources = list(set([filename for _, filename, _ in rows]))
+    prompt = f"""Context:\n{context}\n\nQuestion: {question}\nAnswer:"""
+    try:
+        answer = generate_llm_answer(prompt)
+    except Exception as e:
+        return {"error": str(e)}
+    end_time = time.time()
+    print(f"Time taken to ask_ai: {end_time - start_time} seconds")
+    response = {
+        "answer": answer,
+        "context_chunks": [row[0] for row in rows],
+        "sources": sources,
+    }
+    ANSWER_CACHE.put(q_vec, response, key=top_k, generation=generation)
+    return response
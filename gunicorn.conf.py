@@ -0,0 +1,32 @@
+# Gunicorn config for production: gunicorn -c gunicorn.conf.py app.main:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * multiprocessing.cpu_count() + 1))
+# Embedding a large PDF can take minutes
+timeout = 300
+
+# Postgres connections shared by all workers and their ingest processes; keep
+# it under the server's max_connections (100 by default) with room for admin
+# sessions. Each web worker can run INGEST_WORKERS ingest processes, each with
+# a fixed INGEST_DB_POOL_MAX_CONN pool; the web workers split the rest
+db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", "80"))
+ingest_connections = (
+    workers
+    * int(os.getenv("INGEST_WORKERS", "1"))
+    * int(os.getenv("INGEST_DB_POOL_MAX_CONN", "2"))
+)
+db_pool_max_conn = os.getenv("DB_POOL_MAX_CONN") or max(
+    1, (db_max_connections - ingest_connections) // workers
+)
+
+# Each worker loads its own embedder for questions; split the CPU between
+# them so torch / ONNX Runtime threads don't oversubscribe the cores. With the
+# default 2*CPU+1 workers that is one thread each. Ingest processes don't
+# inherit this: they use INGEST_NUM_THREADS (see utils/ingest_queue.py)
+raw_env = [
+    f"EMBEDDING_NUM_THREADS={max(1, multiprocessing.cpu_count() // workers)}",
+    f"DB_POOL_MAX_CONN={db_pool_max_conn}",
+]
@@ -1,8 +1,13 @@
 # Utility modules for docHelper
 import functools
+import inspect
+import os
 import time
 from typing import Any, Callable
 
+# Set TIMEIT=0 to skip per-call timing prints (e.g. on busy production workers)
+TIMEIT_ENABLED = os.getenv("TIMEIT", "1") != "0"
+
 
 def timeit(func: Callable) -> Callable:
     """
@@ -12,7 +17,24 @@ def timeit(func: Callable) -> Callable:
         @timeit
         def my_function():
             pass
+
+    Coroutine functions are timed until they complete, not until they return
+    a coroutine. With TIMEIT=0 the function is returned undecorated.
     """
+    if not TIMEIT_ENABLED:
+        return func
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs) -> Any:
+            start_time = time.time()
+            result = await func(*args, **kwargs)
+            end_time = time.time()
+            print(f"{func.__name__} took {end_time - start_time:.2f} seconds")
+            return result
+
+        return async_wrapper
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs) -> Any:
@@ -25,10 +25,4 @@ class Chunk:
     pdf_id: int
     chunk_index: int
     text: str
-
-
-@dataclass
-class Embedding:
-    id: Optional[int]
-    chunk_id: int
-    embedding: List[float]
+    embedding: Optional[List[float]] = None
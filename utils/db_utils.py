@@ -1,26 +1,171 @@
+import atexit
 import os
-from io import StringIO
-from typing import Optional
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
 
+import numpy as np
 import psycopg2
 from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 from utils import timeit
 
 load_dotenv()
 
+# Connections kept open while idle; ones checked out above this are closed on release
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", "1"))
+# Per process: every web worker and ingest process has its own pool, so the
+# total is this times the process count (gunicorn.conf.py derives it from
+# DB_MAX_CONNECTIONS and the worker count; ingest processes use
+# INGEST_DB_POOL_MAX_CONN instead)
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "8"))
+# HNSW candidate list size per query: higher is better recall, slower search
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+EMBEDDING_DIM = 384
+# clean_existing_chunks_batch reports progress about once per this many chunks
+CLEAN_PROGRESS_EVERY = 1000
+# Seconds a process reuses the corpus generation it last read
+CORPUS_GENERATION_TTL = float(os.getenv("CORPUS_GENERATION_TTL", "5"))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+# ThreadedConnectionPool raises when exhausted; make callers wait for a free slot instead
+_POOL_SLOTS = threading.BoundedSemaphore(DB_POOL_MAX_CONN)
+_VECTOR_REGISTERED = False
+# Whether the server's pgvector has halfvec (0.7+); checked once per process
+_HALFVEC_SUPPORTED = None
+# (generation, time.monotonic() when read), see get_corpus_generation
+_CORPUS_GENERATION = (None, 0.0)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Pooled connection that remembers which statements its session has
+    PREPAREd and which session settings it has applied.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.ef_search = None
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                conn_str = os.getenv("DATABASE_URL")
+                if conn_str:
+                    _POOL = ThreadedConnectionPool(
+                        DB_POOL_MIN_CONN,
+                        DB_POOL_MAX_CONN,
+                        dsn=conn_str,
+                        connection_factory=PooledConnection,
+                    )
+                else:
+                    _POOL = ThreadedConnectionPool(
+                        DB_POOL_MIN_CONN,
+                        DB_POOL_MAX_CONN,
+                        dbname=os.getenv("PGDATABASE", "postgres"),
+                        user=os.getenv("PGUSER", "postgres"),
+                        password=os.getenv("PGPASSWORD", "password"),
+                        host=os.getenv("PGHOST", "0.0.0.0"),
+                        port=os.getenv("PGPORT", "15432"),
+                        connection_factory=PooledConnection,
+                    )
+                atexit.register(_POOL.closeall)
+    return _POOL
+
+
+def set_pool_max_conn(max_conn: int):
+    """
+    Change this process's pool limit. Only takes effect before its first
+    connection, e.g. from a worker process initializer.
+    """
+    global DB_POOL_MAX_CONN, _POOL_SLOTS
+    if _POOL is not None:
+        print("WARNING!!! DB pool already created; pool size unchanged")
+        return
+    DB_POOL_MAX_CONN = max_conn
+    _POOL_SLOTS = threading.BoundedSemaphore(max_conn)
+
+
+def _register_vector_type(conn):
+    """
+    Register pgvector's adapter process-wide, so numpy arrays can be passed
+    directly as vector parameters instead of hand-built text literals.
+    """
+    global _VECTOR_REGISTERED
+    try:
+        register_vector(conn, globally=True)
+        _VECTOR_REGISTERED = True
+    except psycopg2.ProgrammingError:
+        # vector extension not created yet (init_tables hasn't run); retry later
+        pass
+    conn.rollback()
+
 
 def get_db_conn():
-    conn_str = os.getenv("DATABASE_URL")
-    if conn_str:
-        return psycopg2.connect(conn_str)
-    return psycopg2.connect(
-        dbname=os.getenv("PGDATABASE", "postgres"),
-        user=os.getenv("PGUSER", "postgres"),
-        password=os.getenv("PGPASSWORD", "password"),
-        host=os.getenv("PGHOST", "0.0.0.0"),
-        port=os.getenv("PGPORT", "15432"),
-    )
+    """Check out a pooled connection; hand it back with release_db_conn."""
+    _POOL_SLOTS.acquire()
+    try:
+        pool = _get_pool()
+        conn = pool.getconn()
+        if conn.closed:
+            # Dropped by the server while idle in the pool; replace it
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        if not _VECTOR_REGISTERED:
+            _register_vector_type(conn)
+        return conn
+    except Exception:
+        _POOL_SLOTS.release()
+        raise
+
+
+def release_db_conn(conn):
+    """Return a connection taken with get_db_conn to the pool."""
+    try:
+        # A connection that broke mid-request is discarded, not pooled
+        _get_pool().putconn(conn, close=bool(conn.closed))
+    finally:
+        _POOL_SLOTS.release()
+
+
+def execute_prepared(cur, name: str, sql: str, params: tuple):
+    """
+    Run a statement through a server-side prepared statement.
+
+    The statement (written with $1, $2, ... placeholders) is PREPAREd once per
+    pooled connection, so repeat calls skip Postgres' parse and plan steps.
+    """
+    conn = cur.connection
+    if name not in conn.prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        conn.prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def set_ef_search(conn):
+    """
+    Set hnsw.ef_search for the connection's session, once per pooled
+    connection rather than with SET LOCAL on every query. Committed right
+    away, since a rolled-back transaction would undo the SET.
+    """
+    if conn.ef_search != HNSW_EF_SEARCH:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SET hnsw.ef_search = %s", (HNSW_EF_SEARCH,))
+        conn.ef_search = HNSW_EF_SEARCH
 
 
 def execute_sql(sql, params=None):
@@ -30,7 +175,7 @@ def execute_sql(sql, params=None):
             with conn.cursor() as cur:
                 cur.execute(sql, params)
     finally:
-        conn.close()
+        release_db_conn(conn)
 
 
 def init_tables():
@@ -56,29 +201,183 @@ def init_tables():
         text TEXT NOT NULL,
         embedding VECTOR(384) -- Store embedding directly with chunk
     );
+    -- Earlier versions inserted "default" on every startup: fold duplicate
+    -- orgs into their oldest row before enforcing unique names
+    UPDATE pdfs p SET org_id = d.keep_id
+        FROM (SELECT id, MIN(id) OVER (PARTITION BY name) AS keep_id FROM orgs) d
+        WHERE p.org_id = d.id AND d.id <> d.keep_id;
+    DELETE FROM orgs o USING orgs k WHERE o.name = k.name AND o.id > k.id;
+    CREATE UNIQUE INDEX IF NOT EXISTS orgs_name_key ON orgs (name);
+    -- Single-row counter bumped by every change to the searchable chunks
+    CREATE TABLE IF NOT EXISTS corpus_state (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        generation BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO corpus_state DEFAULT VALUES ON CONFLICT DO NOTHING;
     """
     execute_sql(sql)
-    execute_sql("INSERT INTO orgs (name) VALUES (%s)", ("default",))
+    execute_sql(
+        "INSERT INTO orgs (name) VALUES (%s) ON CONFLICT (name) DO NOTHING",
+        ("default",),
+    )
+
+
+def supports_halfvec(cur) -> bool:
+    global _HALFVEC_SUPPORTED
+    if _HALFVEC_SUPPORTED is None:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+        version = tuple(int(part) for part in row[0].split(".")[:2]) if row else ()
+        _HALFVEC_SUPPORTED = version >= (0, 7)
+    return _HALFVEC_SUPPORTED
+
+
+def inner_product_expr(cur, param: str) -> str:
+    """
+    SQL for the negative inner product between chunk embeddings and a query
+    vector parameter. It has to use the indexed expression for Postgres to
+    search through the HNSW index.
+    """
+    if supports_halfvec(cur):
+        halfvec = f"halfvec({EMBEDDING_DIM})"
+        return f"c.embedding::{halfvec} <#> {param}::{halfvec}"
+    return f"c.embedding <#> {param}"
+
+
+def _bump_corpus_generation(cur):
+    """
+    Mark the searchable chunks as changed, in the caller's transaction so the
+    new generation becomes visible together with the change.
+    """
+    global _CORPUS_GENERATION
+    cur.execute("UPDATE corpus_state SET generation = generation + 1")
+    _CORPUS_GENERATION = (None, 0.0)
+
+
+def get_corpus_generation() -> int:
+    """
+    A counter that changes whenever PDFs are added or removed or chunks are
+    re-cleaned, for processes that cache answers locally. Read from the DB at
+    most once per CORPUS_GENERATION_TTL seconds, so cache hits usually skip
+    the DB entirely; changes made by other processes can go unnoticed for up
+    to that long.
+    """
+    global _CORPUS_GENERATION
+    generation, read_at = _CORPUS_GENERATION
+    fresh = time.monotonic() - read_at < CORPUS_GENERATION_TTL
+    if generation is not None and fresh:
+        return generation
+    conn = get_db_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                execute_prepared(
+                    cur,
+                    "corpus_generation",
+                    "SELECT generation FROM corpus_state",
+                    (),
+                )
+                row = cur.fetchone()
+                generation = row[0] if row else 0
+    finally:
+        release_db_conn(conn)
+    _CORPUS_GENERATION = (generation, time.monotonic())
+    return generation
+
+
+def ensure_embedding_index():
+    """
+    Build the HNSW index on chunk embeddings if it doesn't exist yet.
+
+    Called after chunks are loaded rather than from init_tables, since a
+    bulk build over loaded rows is much faster than growing the graph row by
+    row. CONCURRENTLY keeps uploads and questions running during the build.
+    On pgvector 0.7+ the index is over a halfvec cast, half the size of the
+    float32 column. Embeddings are stored L2-normalized, so inner product
+    ranks like cosine.
+    """
+    conn = get_db_conn()
+    try:
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            if supports_halfvec(cur):
+                name = "chunks_embedding_halfvec_hnsw"
+                definition = f"""
+                    ON chunks USING hnsw ((embedding::halfvec({EMBEDDING_DIM})) halfvec_ip_ops)
+                    WITH (m = 16, ef_construction = 64)
+                """
+            else:
+                name = "chunks_embedding_hnsw"
+                definition = """
+                    ON chunks USING hnsw (embedding vector_ip_ops)
+                    WITH (m = 16, ef_construction = 64)
+                """
+            # A failed or interrupted concurrent build leaves an INVALID
+            # index behind, which IF NOT EXISTS would then skip forever
+            cur.execute(
+                """
+                SELECT i.indisvalid FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s
+                """,
+                (name,),
+            )
+            row = cur.fetchone()
+            if row is not None and not row[0]:
+                print(f"Rebuilding invalid index {name}")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+    except Exception as e:
+        print(f"Error creating embedding index: {e}")
+    finally:
+        try:
+            conn.autocommit = False
+        except psycopg2.Error:
+            # Broken connection; release_db_conn discards it
+            pass
+        release_db_conn(conn)
+
+
+GET_ORG_SQL = "SELECT id FROM orgs WHERE name = $1 AND is_active = TRUE"
 
 
 def get_or_create_org(name: str = "default") -> Optional[int]:
+    """
+    Get the id of the active org with this name, creating the org if there is
+    none. Returns None if the org exists but has been deactivated.
+    """
     conn = get_db_conn()
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT id FROM orgs WHERE name=%s AND is_active=TRUE", (name,)
+                # Plain lookup first: an upsert would write a new row version
+                # on every call
+                execute_prepared(cur, "get_org", GET_ORG_SQL, (name,))
+                row = cur.fetchone()
+                if row:
+                    return row[0]
+                execute_prepared(
+                    cur,
+                    "insert_org",
+                    "INSERT INTO orgs (name) VALUES ($1) "
+                    "ON CONFLICT (name) DO NOTHING RETURNING id",
+                    (name,),
                 )
                 row = cur.fetchone()
                 if row:
                     return row[0]
-                else:
-                    execute_sql(
-                        "INSERT INTO orgs (name) VALUES (%s) RETURNING id", (name,)
-                    )
-                    return cur.fetchone()[0]
+                # Lost a race with another insert, or the org is inactive
+                execute_prepared(cur, "get_org", GET_ORG_SQL, (name,))
+                row = cur.fetchone()
+                return row[0] if row else None
     finally:
-        conn.close()
+        release_db_conn(conn)
+
+
+INSERT_PDF_SQL = (
+    "INSERT INTO pdfs (org_id, filename, chunk_size) VALUES ($1, $2, $3) RETURNING id"
+)
 
 
 def insert_pdf(org_id: int, filename: str, chunk_size: int) -> int:
@@ -86,89 +385,197 @@ def insert_pdf(org_id: int, filename: str, chunk_size: int) -> int:
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO pdfs (org_id, filename, chunk_size) VALUES (%s, %s, %s) RETURNING id",
+                execute_prepared(
+                    cur,
+                    "insert_pdf",
+                    INSERT_PDF_SQL,
                     (org_id, filename, chunk_size),
                 )
                 return cur.fetchone()[0]
     finally:
-        conn.close()
+        release_db_conn(conn)
 
 
-@timeit
-def bulk_insert_chunks_with_embeddings(
-    pdf_id: int, chunks_data: list, batch_size: int = 300
-) -> bool:
-    conn = get_db_conn()
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                # Process in batches of 100
-                for i in range(0, len(chunks_data), batch_size):
-                    batch = chunks_data[i : i + batch_size]
-                    data_to_insert = [
-                        (pdf_id, idx, text, embedding) for idx, text, embedding in batch
-                    ]
-                    cur.executemany(
-                        "INSERT INTO chunks (pdf_id, chunk_index, text, embedding) VALUES (%s, %s, %s, %s)",
-                        data_to_insert,
-                    )
-        return True
-    except Exception as e:
-        print(f"Error in bulk insert: {e}")
-        return False
-    finally:
-        conn.close()
+def _insert_chunk_values(cur, pdf_id: int, chunks_data: list, batch_size: int = 300):
+    """
+    INSERT (chunk_index, text, embedding) rows for a PDF on an open cursor,
+    one multi-row INSERT per batch_size rows. Slower than _copy_chunks; used
+    when COPY fails.
+    """
+    for i in range(0, len(chunks_data), batch_size):
+        batch = chunks_data[i : i + batch_size]
+        vector_strs = _format_vectors([e for _, _, e in batch])
+        data_to_insert = [
+            (pdf_id, idx, text, vector_str)
+            for (idx, text, _), vector_str in zip(batch, vector_strs)
+        ]
+        execute_values(
+            cur,
+            "INSERT INTO chunks (pdf_id, chunk_index, text, embedding) VALUES %s",
+            data_to_insert,
+            template="(%s, %s, %s, %s::vector)",
+            page_size=batch_size,
+        )
+
+
+def _format_vectors(embeddings) -> list:
+    """
+    Format an (N, d) embedding matrix as pgvector text literals, for the
+    paths that send vectors as text rather than binary COPY. One %-format per
+    row instead of pgvector's str(float(v)) per element, and %.9g still
+    round-trips float32 exactly.
+    """
+    rows = np.asarray(embeddings, dtype=np.float32).tolist()
+    if not rows:
+        return []
+    row_format = "[" + ",".join(["%.9g"] * len(rows[0])) + "]"
+    return [row_format % tuple(row) for row in rows]
+
+
+# PGCOPY signature, flags field and header extension length
+_COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\0" + struct.pack("!ii", 0, 0)
+_COPY_BINARY_TRAILER = struct.pack("!h", -1)
+
+
+def _copy_rows(pdf_id: int, chunks_data):
+    """Yield the binary COPY payload for (chunk_index, text, embedding) rows."""
+    yield _COPY_BINARY_HEADER
+    # Field count, then the pdf_id int4 shared by every row
+    row_head = struct.pack("!hii", 4, 4, pdf_id)
+    vector_head = None
+    for idx, text, embedding in chunks_data:
+        # Binary COPY: embeddings go over as raw big-endian float32, so there
+        # is no per-float formatting and no escaping of the text column
+        vector = np.asarray(embedding, dtype=">f4")
+        if vector_head is None:
+            # pgvector's binary format: dim and an unused flags word, then the floats
+            dim = vector.shape[0]
+            vector_head = struct.pack("!iHH", 4 + 4 * dim, dim, 0)
+        text_bytes = text.encode("utf-8")
+        yield b"".join(
+            (
+                row_head,
+                struct.pack("!iii", 4, idx, len(text_bytes)),
+                text_bytes,
+                vector_head,
+                vector.tobytes(),
+            )
+        )
+    yield _COPY_BINARY_TRAILER
+
+
+class _IterReader:
+    """Minimal file-like reader over an iterator of bytes, for copy_expert."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+
+    def read(self, size: int = -1) -> bytes:
+        parts = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            have += len(chunk)
+        data = b"".join(parts)
+        if size < 0:
+            self._buf = b""
+            return data
+        self._buf = data[size:]
+        return data[:size]
+
+
+def _copy_chunks(cur, pdf_id: int, chunks_data):
+    """
+    COPY (chunk_index, text, embedding) rows for a PDF on an open cursor.
+
+    Rows are encoded as psycopg2 reads them, so the payload is never held in
+    memory as a whole; chunks_data can be any iterable, including a generator.
+    """
+    cur.copy_expert(
+        "COPY chunks (pdf_id, chunk_index, text, embedding) FROM STDIN WITH (FORMAT BINARY)",
+        _IterReader(_copy_rows(pdf_id, chunks_data)),
+    )
 
 
 @timeit
-def bulk_insert_chunks_with_embeddings_copy(pdf_id: int, chunks_data: list) -> bool:
+def insert_pdf_with_chunks(
+    org_id: int, filename: str, chunk_size: int, chunks_data: Iterable
+) -> Optional[int]:
     """
-    Bulk insert chunks with their embeddings using COPY command for maximum performance.
+    Insert a PDF row and COPY all its chunks on one connection in one transaction.
+    If the COPY fails, the transaction is retried once with batched INSERTs.
 
     Args:
-        pdf_id: PDF ID
-        chunks_data: List of tuples (chunk_index, text, embedding)
+        org_id: Org ID
+        filename: Name of the PDF file
+        chunk_size: Words per chunk used at ingest
+        chunks_data: Iterable of tuples (chunk_index, text, embedding), in any
+            order; a generator is consumed as COPY sends it
 
     Returns:
-        bool: Success status
+        int: The new PDF ID, or None if the insert failed (nothing is committed)
     """
+    rows = iter(chunks_data)
+    # Rows already handed to COPY, kept for the INSERT retry
+    sent = []
+    source_error = None
+
+    def recorded():
+        nonlocal source_error
+        try:
+            for row in rows:
+                sent.append(row)
+                yield row
+        except Exception as e:
+            source_error = e
+            raise
+
     conn = get_db_conn()
     try:
-        with conn:
-            with conn.cursor() as cur:
-                # Prepare data for COPY using StringIO
-                copy_data = StringIO()
-                for idx, text, embedding in chunks_data:
-                    # Convert embedding list to PostgreSQL vector format
-                    embedding_str = f"[{','.join(map(str, embedding))}]"
-                    # Escape any special characters in text
-                    text_escaped = (
-                        text.replace("\t", "\\t")
-                        .replace("\n", "\\n")
-                        .replace("\r", "\\r")
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    execute_prepared(
+                        cur,
+                        "insert_pdf",
+                        INSERT_PDF_SQL,
+                        (org_id, filename, chunk_size),
                     )
-                    copy_data.write(
-                        f"{pdf_id}\t{idx}\t{text_escaped}\t{embedding_str}\n"
+                    pdf_id = cur.fetchone()[0]
+                    _copy_chunks(cur, pdf_id, recorded())
+                    _bump_corpus_generation(cur)
+                    return pdf_id
+        except psycopg2.Error as e:
+            # psycopg2 reports errors from the rows themselves (e.g. a failed
+            # encode) as COPY errors too; those aren't retried, nor is a
+            # connection that's gone
+            if source_error is not None:
+                raise source_error
+            if conn.closed:
+                raise
+            print(f"COPY of chunks failed ({str(e).strip()}), retrying with INSERT")
+            sent.extend(rows)
+            with conn:
+                with conn.cursor() as cur:
+                    execute_prepared(
+                        cur,
+                        "insert_pdf",
+                        INSERT_PDF_SQL,
+                        (org_id, filename, chunk_size),
                     )
-
-                # Reset file pointer to beginning
-                copy_data.seek(0)
-
-                # Use COPY FROM for maximum performance
-                cur.copy_from(
-                    copy_data,
-                    "chunks",
-                    columns=("pdf_id", "chunk_index", "text", "embedding"),
-                    sep="\t",
-                )
-
-                return True
+                    pdf_id = cur.fetchone()[0]
+                    _insert_chunk_values(cur, pdf_id, sent)
+                    _bump_corpus_generation(cur)
+                    return pdf_id
     except Exception as e:
-        print(f"Error in COPY bulk insert: {e}")
-        return False
+        print(f"Error inserting PDF with chunks: {e}")
+        return None
     finally:
-        conn.close()
+        release_db_conn(conn)
 
 
 def get_pdf_id_by_filename(filename: str, org_id: int = None) -> Optional[int]:
@@ -178,19 +585,23 @@ def get_pdf_id_by_filename(filename: str, org_id: int = None) -> Optional[int]:
         with conn:
             with conn.cursor() as cur:
                 if org_id:
-                    cur.execute(
-                        "SELECT id FROM pdfs WHERE filename=%s AND org_id=%s AND is_active=TRUE",
+                    execute_prepared(
+                        cur,
+                        "get_pdf_id_by_org",
+                        "SELECT id FROM pdfs WHERE filename=$1 AND org_id=$2 AND is_active=TRUE",
                         (filename, org_id),
                     )
                 else:
-                    cur.execute(
-                        "SELECT id FROM pdfs WHERE filename=%s AND is_active=TRUE",
+                    execute_prepared(
+                        cur,
+                        "get_pdf_id",
+                        "SELECT id FROM pdfs WHERE filename=$1 AND is_active=TRUE",
                         (filename,),
                     )
                 row = cur.fetchone()
                 return row[0] if row else None
     finally:
-        conn.close()
+        release_db_conn(conn)
 
 
 def remove_pdf_data(filename: str, org_id: int = None) -> dict:
@@ -209,24 +620,70 @@ def remove_pdf_data(filename: str, org_id: int = None) -> dict:
     try:
         with conn:
             with conn.cursor() as cur:
-                # Get PDF ID
-                pdf_id = get_pdf_id_by_filename(filename, org_id)
-                if not pdf_id:
+                # Lookup, chunk delete and soft delete of the PDF in one round-trip
+                # (embeddings are part of the chunks table). Every active row for
+                # the filename goes: re-uploads add one each, and the stored file
+                # they all came from is removed along with them.
+                execute_prepared(
+                    cur,
+                    "remove_pdf",
+                    """
+                    WITH target AS (
+                        SELECT id FROM pdfs
+                        WHERE filename = $1 AND ($2::int IS NULL OR org_id = $2)
+                            AND is_active = TRUE
+                    ), deleted AS (
+                        DELETE FROM chunks WHERE pdf_id IN (SELECT id FROM target)
+                    )
+                    UPDATE pdfs SET is_active = FALSE
+                    WHERE id IN (SELECT id FROM target)
+                    RETURNING id
+                    """,
+                    (filename, org_id or None),
+                )
+                removed = [pdf_id for (pdf_id,) in cur.fetchall()]
+                if not removed:
                     return {"success": False, "error": "PDF not found in database"}
-
-                # Hard delete: Remove chunks (embeddings are now part of chunks table)
-                cur.execute("DELETE FROM chunks WHERE pdf_id=%s", (pdf_id,))
-
-                cur.execute("UPDATE pdfs SET is_active=FALSE WHERE id=%s", (pdf_id,))
+                _bump_corpus_generation(cur)
                 return {
                     "success": True,
                     "message": f"PDF '{filename}' and all associated data removed",
-                    "pdf_id": pdf_id,
+                    "pdf_id": max(removed),
+                    "pdf_ids": sorted(removed),
                 }
     except Exception as e:
         return {"success": False, "error": str(e)}
     finally:
-        conn.close()
+        release_db_conn(conn)
+
+
+def _update_cleaned_chunks(cur, updates: list, future) -> int:
+    """
+    Wait for a batch's new embeddings and write its (chunk_id, cleaned_text)
+    updates with one UPDATE. Returns the number of chunks updated.
+    """
+    try:
+        new_vectors = future.result()
+        execute_values(
+            cur,
+            """
+            UPDATE chunks AS c
+            SET text = v.text, embedding = v.embedding
+            FROM (VALUES %s) AS v(id, text, embedding)
+            WHERE c.id = v.id
+            """,
+            [
+                (chunk_id, cleaned_text, vector_str)
+                for (chunk_id, cleaned_text), vector_str in zip(
+                    updates, _format_vectors(new_vectors)
+                )
+            ],
+            template="(%s, %s, %s::vector)",
+        )
+        return len(updates)
+    except Exception as e:
+        print(f"Error updating batch of {len(updates)} chunks: {e}")
+        return 0
 
 
 def clean_existing_chunks_batch(batch_size: int = 10) -> dict:
@@ -260,55 +717,70 @@ def clean_existing_chunks_batch(batch_size: int = 10) -> dict:
                 vector_regenerated_count = 0
                 embedder = get_embedder()
 
-                # Process in batches
+                # Stream rows through a server-side cursor: one forward scan,
+                # instead of Postgres re-skipping OFFSET rows for every batch
                 offset = 0
-                while offset < total_chunks:
-                    # Get batch of chunks
-                    cur.execute(
-                        """
-                        SELECT c.id, c.text, c.pdf_id, p.filename 
-                        FROM chunks c 
-                        JOIN pdfs p ON c.pdf_id = p.id 
+                pending = None
+                with conn.cursor(
+                    name="clean_chunks"
+                ) as read_cur, ThreadPoolExecutor(max_workers=1) as embed_pool:
+                    read_cur.itersize = batch_size
+                    read_cur.execute("""
+                        SELECT c.id, c.text, c.pdf_id, p.filename
+                        FROM chunks c
+                        JOIN pdfs p ON c.pdf_id = p.id
                         WHERE c.text IS NOT NULL AND p.is_active = TRUE
                         ORDER BY c.id
-                        LIMIT %s OFFSET %s
-                    """,
-                        (batch_size, offset),
-                    )
-
-                    batch_chunks = cur.fetchall()
-                    if not batch_chunks:
-                        break
-
-                    # Process batch
-                    for chunk_id, text, pdf_id, filename in batch_chunks:
-                        if text:
-                            # Clean the text
-                            cleaned_text = TextCleaner.clean_text_aggressive(text)
-
-                            # Only update if the text actually changed and is not empty
-                            if cleaned_text != text and cleaned_text.strip():
-                                try:
-                                    # Generate new embedding
-                                    new_vector = embedder.embed([cleaned_text])[0]
-
-                                    # Update both text and embedding in one operation
-                                    cur.execute(
-                                        "UPDATE chunks SET text = %s, embedding = %s WHERE id = %s",
-                                        (cleaned_text, new_vector, chunk_id),
-                                    )
-                                    cleaned_count += 1
-                                    vector_regenerated_count += 1
-
-                                except Exception as e:
-                                    print(f"Error updating chunk {chunk_id}: {e}")
-                                    # Continue with other chunks even if one fails
-
-                    offset += batch_size
-                    print(
-                        f"Processed batch: {min(offset, total_chunks)}/{total_chunks} chunks"
-                    )
-
+                    """)
+                    while True:
+                        batch_chunks = read_cur.fetchmany(batch_size)
+                        if not batch_chunks:
+                            break
+
+                        # Clean the batch, keeping only chunks whose text actually
+                        # changed and is not empty
+                        cleaned = TextCleaner.clean_batch(
+                            [text or "" for _, text, _, _ in batch_chunks]
+                        )
+                        updates = [
+                            (chunk_id, cleaned_text)
+                            for (chunk_id, text, _, _), cleaned_text in zip(
+                                batch_chunks, cleaned
+                            )
+                            if text and cleaned_text != text and cleaned_text.strip()
+                        ]
+
+                        # Embed this batch in the background (encode releases
+                        # the GIL) while the previous batch's UPDATE runs
+                        future = None
+                        if updates:
+                            future = embed_pool.submit(
+                                embedder.embed_corpus,
+                                [cleaned_text for _, cleaned_text in updates],
+                                verbose=False,
+                            )
+                        if pending:
+                            updated = _update_cleaned_chunks(cur, *pending)
+                            cleaned_count += updated
+                            vector_regenerated_count += updated
+                        pending = (updates, future) if updates else None
+
+                        offset += batch_size
+                        if (
+                            offset % CLEAN_PROGRESS_EVERY < batch_size
+                            or offset >= total_chunks
+                        ):
+                            print(
+                                f"Processed batch: {min(offset, total_chunks)}/{total_chunks} chunks"
+                            )
+
+                    if pending:
+                        updated = _update_cleaned_chunks(cur, *pending)
+                        cleaned_count += updated
+                        vector_regenerated_count += updated
+
+                if cleaned_count:
+                    _bump_corpus_generation(cur)
                 return {
                     "success": True,
                     "message": f"Cleaned {cleaned_count} chunks and regenerated {vector_regenerated_count} vectors in database (batch processing)",
@@ -320,7 +792,7 @@ def clean_existing_chunks_batch(batch_size: int = 10) -> dict:
     except Exception as e:
         return {"success": False, "error": str(e)}
     finally:
-        conn.close()
+        release_db_conn(conn)
 
 
 def migrate_to_merged_schema():
@@ -380,7 +852,7 @@ def migrate_to_merged_schema():
     except Exception as e:
         return {"success": False, "error": str(e)}
     finally:
-        conn.close()
+        release_db_conn(conn)
 
 
 if __name__ == "__main__":
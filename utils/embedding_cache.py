@@ -0,0 +1,129 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from utils.file_manager import PROJECT_ROOT
+
+# Persistent chunk-hash -> embedding store shared by every PDF (and process)
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(PROJECT_ROOT, "data", "embedding_cache.db")
+)
+# Rows kept before the least recently used are pruned (~1.5 KB each at d=384)
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "200000"))
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+# Hits refresh last_used at most this often, so lookups rarely write
+_TOUCH_INTERVAL = 24 * 3600
+# Rows written by this process between checks of the row count
+_PRUNE_EVERY = 10000
+
+
+def chunk_key(text: str) -> bytes:
+    """Stable 16-byte digest identifying a chunk's exact text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed cache of float32 embeddings keyed by (model, chunk digest),
+    so repeated boilerplate and re-uploaded documents skip the forward pass.
+    Once it holds more than max_rows, the least recently used rows are pruned.
+    """
+
+    def __init__(
+        self, path: str = EMBEDDING_CACHE_PATH, max_rows: int = EMBEDDING_CACHE_MAX_ROWS
+    ):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, key BLOB NOT NULL, vector BLOB NOT NULL, "
+                "last_used INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (model, key))"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(embeddings)")]
+            if "last_used" not in columns:
+                # Caches created before pruning existed
+                conn.execute(
+                    "ALTER TABLE embeddings "
+                    "ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0"
+                )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+                "ON embeddings (last_used)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model: str, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Return the cached vectors for whichever keys are present."""
+        found = {}
+        stale = []
+        now = int(time.time())
+        conn = self._conn()
+        for i in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[i : i + _LOOKUP_BATCH]
+            rows = conn.execute(
+                "SELECT key, vector, last_used FROM embeddings "
+                "WHERE model = ? AND key IN (%s)" % ",".join("?" * len(batch)),
+                [model, *batch],
+            )
+            for key, blob, last_used in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+                if last_used < now - _TOUCH_INTERVAL:
+                    stale.append(key)
+        if stale:
+            with conn:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in stale],
+                )
+        return found
+
+    def put_many(self, model: str, keys: List[bytes], vectors: np.ndarray):
+        """Store one float32 vector per key, replacing any existing entry."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = int(time.time())
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [(model, key, vec.tobytes(), now) for key, vec in zip(keys, vectors)],
+            )
+        with self._lock:
+            self._written += len(keys)
+            if self._written < _PRUNE_EVERY:
+                return
+            self._written = 0
+        self._prune(conn)
+
+    def _prune(self, conn: sqlite3.Connection):
+        """Delete least recently used rows until 90% of max_rows remain."""
+        (count,) = conn.execute("SELECT count(*) FROM embeddings").fetchone()
+        if count <= self.max_rows:
+            return
+        with conn:
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN ("
+                "SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (count - int(self.max_rows * 0.9),),
+            )
+
+
+EMBEDDING_CACHE = EmbeddingCache()
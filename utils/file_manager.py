@@ -1,7 +1,11 @@
+import multiprocessing
 import os
-import re
-from typing import List, Optional
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional
 
+import aiofiles
 import fitz  # PyMuPDF
 import numpy as np
 import pdfplumber
@@ -21,20 +25,64 @@ os.makedirs(TEXT_STORAGE_DIR, exist_ok=True)
 CLEANED_TEXT_STORAGE_DIR = os.path.join(PROJECT_ROOT, "data", "cleaned")
 os.makedirs(CLEANED_TEXT_STORAGE_DIR, exist_ok=True)
 
+# PDFs with at least this many pages per available core are extracted in parallel
+PARALLEL_EXTRACT_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACT_MIN_PAGES", "200"))
+
+# On-disk dtype for per-PDF vectors: "int8" (row-wise quantized, 4x smaller),
+# "float16" (2x smaller) or "float32"
+VECTOR_STORAGE_DTYPE = os.getenv("VECTOR_STORAGE_DTYPE", "int8")
+
+
+def _extract_pages(pdf, start: int, stop: int) -> str:
+    """Extract the text of pages [start, stop) of an open PyMuPDF document."""
+    text = []
+    for page_num in range(start, stop):
+        page = pdf.load_page(page_num)  # Load one page at a time
+        # Plain-text flags only: images are never decoded
+        _text = page.get_text("text", flags=fitz.TEXTFLAGS_TEXT)
+        if _text:
+            text.append(_text)
+        text.append("\n")
+    return "\n".join(text)
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> str:
+    """Extract the text of pages [start, stop) with PyMuPDF (process pool entry point)."""
+    with fitz.open(pdf_path) as pdf:
+        return _extract_pages(pdf, start, stop)
+
 
 @timeit
 def extract_text_from_pdf(pdf_path: str) -> str:
     """Extract pure text from a PDF file using PyMuPDF (faster) with fallback to pdfplumber."""
     try:
-        text = []
         with fitz.open(pdf_path) as pdf:
-            for page_num in range(pdf.page_count):
-                page = pdf.load_page(page_num)  # Load one page at a time
-                _text = page.get_text()
-                if _text:
-                    text.append(_text)
-                text.append("\n")
-        return "\n".join(text)
+            page_count = pdf.page_count
+            workers = min(
+                os.cpu_count() or 1, page_count // PARALLEL_EXTRACT_MIN_PAGES
+            )
+            if workers <= 1:
+                return _extract_pages(pdf, 0, page_count)
+            # PyMuPDF holds the GIL and a document can't be shared across
+            # threads, so large PDFs are split into page ranges, one process
+            # per range
+            bounds = np.linspace(0, page_count, workers + 1, dtype=int)
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                ) as executor:
+                    parts = executor.map(
+                        _extract_page_range,
+                        [pdf_path] * workers,
+                        bounds[:-1].tolist(),
+                        bounds[1:].tolist(),
+                    )
+                    return "\n".join(parts)
+            except Exception as e:
+                # Still far cheaper than pdfplumber: redo it in this process
+                print(f"Parallel extraction failed, extracting sequentially: {e}")
+                return _extract_pages(pdf, 0, page_count)
     except Exception as e:
         print(f"PyMuPDF failed, falling back to pdfplumber: {e}")
         try:
@@ -59,9 +107,43 @@ def preview_lines(text: str, n: int = 5) -> list:
     return lines[:n] + ["..."] + lines[-n:]
 
 
+# directory -> (st_mtime_ns, listing); a directory's mtime changes whenever
+# an entry is added, removed or renamed
+_LISTING_CACHE = {}
+# path -> (time checked, exists) for the fetch_* helpers. Writes and removals
+# made here invalidate their path; changes made by other processes (ingest
+# workers) show up once the entry is STAT_CACHE_TTL seconds old.
+STAT_CACHE_TTL = float(os.getenv("STAT_CACHE_TTL", "2.0"))
+_STAT_CACHE_MAX_SIZE = 1024
+_STAT_CACHE = {}
+
+
+def _exists_cached(path: str) -> bool:
+    now = time.monotonic()
+    cached = _STAT_CACHE.get(path)
+    if cached and now - cached[0] < STAT_CACHE_TTL:
+        return cached[1]
+    exists = os.path.exists(path)
+    if len(_STAT_CACHE) >= _STAT_CACHE_MAX_SIZE:
+        _STAT_CACHE.clear()
+    _STAT_CACHE[path] = (now, exists)
+    return exists
+
+
+def _list_files(directory: str, extension: str) -> List[str]:
+    mtime = os.stat(directory).st_mtime_ns
+    cached = _LISTING_CACHE.get((directory, extension))
+    if cached and cached[0] == mtime:
+        return list(cached[1])
+    with os.scandir(directory) as entries:
+        files = [e.name for e in entries if e.name.lower().endswith(extension)]
+    _LISTING_CACHE[(directory, extension)] = (mtime, files)
+    return list(files)
+
+
 def list_pdfs() -> List[str]:
     """List all PDF files in the storage directory."""
-    return [f for f in os.listdir(PDF_STORAGE_DIR) if f.lower().endswith(".pdf")]
+    return _list_files(PDF_STORAGE_DIR, ".pdf")
 
 
 def search_pdfs(query: str) -> List[str]:
@@ -72,61 +154,109 @@ def search_pdfs(query: str) -> List[str]:
 def fetch_pdf(filename: str) -> Optional[str]:
     """Get the path to a stored PDF file if it exists."""
     file_path = os.path.join(PDF_STORAGE_DIR, filename)
-    return file_path if os.path.exists(file_path) else None
+    return file_path if _exists_cached(file_path) else None
 
 
-def store_pdf(file_bytes: bytes, filename: str) -> str:
-    """Save a PDF file to the storage directory."""
+async def store_pdf(file_chunks: AsyncIterator[bytes], filename: str) -> str:
+    """Stream a PDF file to the storage directory chunk by chunk."""
     file_path = os.path.join(PDF_STORAGE_DIR, filename)
-    with open(file_path, "wb") as f:
-        f.write(file_bytes)
+    async with aiofiles.open(file_path, "wb") as f:
+        async for chunk in file_chunks:
+            await f.write(chunk)
+    _STAT_CACHE.pop(file_path, None)
     return file_path
 
 
+def quantize_vectors(vectors) -> np.ndarray:
+    """
+    Row-wise symmetric int8 quantization: each row is scaled so its largest
+    magnitude maps to 127. The scale itself isn't kept, since cosine
+    similarity doesn't depend on a row's magnitude.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scale = np.abs(vectors).max(axis=1, keepdims=True) / 127.0
+    scale[scale == 0] = 1.0
+    return np.round(vectors / scale).astype(np.int8)
+
+
 def store_vectors(vectors, filename: str) -> str:
-    """Save a vector file (e.g., .npy) to the vector storage directory."""
+    """
+    Save a vector file (e.g., .npy) to the vector storage directory, as int8,
+    float16 or float32 depending on VECTOR_STORAGE_DTYPE.
+
+    Written to a temp file and renamed into place, so readers holding a
+    memory-map of the previous version never see it truncated underneath them.
+    """
     file_path = os.path.join(VECTOR_STORAGE_DIR, filename)
-    np.save(file_path, vectors)
+    if VECTOR_STORAGE_DTYPE == "int8":
+        vectors = quantize_vectors(vectors)
+    elif VECTOR_STORAGE_DTYPE == "float16":
+        vectors = np.asarray(vectors, dtype=np.float16)
+    else:
+        vectors = np.asarray(vectors, dtype=np.float32)
+    tmp_path = file_path + ".tmp"
+    # Written through a memory-map of the new file, so the rows are copied
+    # straight into the page cache instead of via an intermediate buffer
+    mm = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=vectors.dtype, shape=vectors.shape
+    )
+    mm[:] = vectors
+    mm.flush()
+    del mm
+    os.replace(tmp_path, file_path)
+    _STAT_CACHE.pop(file_path, None)
     return file_path
 
 
 def fetch_vectors(filename: str) -> Optional[str]:
     """Get the path to a stored vector file if it exists."""
     file_path = os.path.join(VECTOR_STORAGE_DIR, filename)
-    return file_path if os.path.exists(file_path) else None
+    return file_path if _exists_cached(file_path) else None
 
 
 def list_vectors() -> List[str]:
     """List all vector files in the storage directory."""
-    return [f for f in os.listdir(VECTOR_STORAGE_DIR) if f.lower().endswith(".npy")]
+    return _list_files(VECTOR_STORAGE_DIR, ".npy")
+
+
+def _write_bytes(file_path: str, data: bytes):
+    # Straight to the fd: one write syscall for the whole buffer in the common
+    # case, with no buffered-IO layer copying it again
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
 
 
 def store_text(text: str, filename: str) -> str:
     """Save extracted text to the text storage directory as .txt."""
     file_path = os.path.join(TEXT_STORAGE_DIR, filename)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(text)
+    _write_bytes(file_path, text.encode("utf-8"))
+    _STAT_CACHE.pop(file_path, None)
     return file_path
 
 
 def fetch_text(filename: str) -> Optional[str]:
     """Get the path to a stored text file if it exists."""
     file_path = os.path.join(TEXT_STORAGE_DIR, filename)
-    return file_path if os.path.exists(file_path) else None
+    return file_path if _exists_cached(file_path) else None
 
 
 def store_cleaned_text(text: str, filename: str) -> str:
     """Save cleaned text to the cleaned text storage directory as .txt."""
     file_path = os.path.join(CLEANED_TEXT_STORAGE_DIR, filename)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(text)
+    _write_bytes(file_path, text.encode("utf-8"))
+    _STAT_CACHE.pop(file_path, None)
     return file_path
 
 
 def fetch_cleaned_text(filename: str) -> Optional[str]:
     """Get the path to a stored cleaned text file if it exists."""
     file_path = os.path.join(CLEANED_TEXT_STORAGE_DIR, filename)
-    return file_path if os.path.exists(file_path) else None
+    return file_path if _exists_cached(file_path) else None
 
 
 @timeit
@@ -142,55 +272,70 @@ def advanced_chunk_text(
     Returns:
         List[str]: List of text chunks.
     """
-    # Split into sentences (simple regex, can be improved)
-    sentences = re.split(r"(?<=[.!?])\s+", text)
+    # One flat word list; a sentence ends after any word ending in . ! or ?
+    # (exactly where splitting on (?<=[.!?])\s+ would). Chunks are (lo, hi)
+    # windows over it, so only the emitted strings are ever allocated.
+    words = text.split()
+    ends = [i for i, word in enumerate(words, 1) if word[-1] in ".!?"]
+    # The last sentence runs to the end of the text; trailing whitespace after
+    # a full stop leaves one more (empty) sentence, as the regex split does
+    if not ends or ends[-1] != len(words) or text[-1:].isspace():
+        ends.append(len(words))
     chunks = []
-    current_chunk = []
-    current_len = 0
-    for sent in sentences:
-        words = sent.split()
-        if current_len + len(words) > chunk_size and current_chunk:
+    lo = hi = 0
+    for end in ends:
+        if end - lo > chunk_size and hi > lo:
             # Save current chunk
-            chunks.append(" ".join(current_chunk))
-            # Start new chunk with overlap
-            if overlap > 0:
-                overlap_words = (
-                    current_chunk[-overlap:]
-                    if len(current_chunk) >= overlap
-                    else current_chunk
-                )
-                current_chunk = overlap_words.copy()
-                current_len = len(current_chunk)
-            else:
-                current_chunk = []
-                current_len = 0
-        current_chunk.extend(words)
-        current_len += len(words)
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-    return [c.strip() for c in chunks if c.strip()]
+            chunks.append(" ".join(words[lo:hi]))
+            # Start new chunk with the last `overlap` words (or the whole chunk
+            # when it's shorter than that)
+            lo = max(lo, hi - overlap) if overlap > 0 else hi
+        hi = end
+    if hi > lo:
+        chunks.append(" ".join(words[lo:hi]))
+    # Chunks are joined from non-empty words, so none is blank or padded
+    return chunks
+
+
+@lru_cache(maxsize=32)
+def _cached_chunks(
+    cleaned_text_path: str, mtime_ns: int, chunk_size: int, overlap: int
+) -> tuple:
+    # mtime_ns is only part of the key: a rewritten file gets a fresh entry
+    with open(cleaned_text_path, "r", encoding="utf-8") as f:
+        cleaned_text = f.read()
+    return tuple(
+        advanced_chunk_text(cleaned_text, chunk_size=chunk_size, overlap=overlap)
+    )
 
 
 @timeit
 def read_cleaned_chunks_and_vectors(
     pdf_filename: str, chunk_size: int = 200, overlap: int = 30
 ) -> Optional[tuple]:
-    """Return (chunks, vectors) for a given PDF filename using cleaned text and advanced chunking, or None if not available."""
+    """Return (chunks, vectors) for a given PDF filename using cleaned text and advanced chunking, or None if not available.
+
+    Vectors are returned as a read-only memory-map, so only the pages that are
+    actually scored get read from disk. Chunks come back as a shared tuple,
+    cached per (cleaned text file, mtime, chunk_size, overlap).
+    """
     fname_without_ext = os.path.splitext(pdf_filename)[0]
     # Cleaned text file
     cleaned_text_filename = fname_without_ext + ".txt"
     cleaned_text_path = fetch_cleaned_text(cleaned_text_filename)
     if not cleaned_text_path:
         return None
-    with open(cleaned_text_path, "r", encoding="utf-8") as f:
-        cleaned_text = f.read()
-    chunks = advanced_chunk_text(cleaned_text, chunk_size=chunk_size, overlap=overlap)
+    try:
+        mtime_ns = os.stat(cleaned_text_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    chunks = _cached_chunks(cleaned_text_path, mtime_ns, chunk_size, overlap)
     # Vector file
     vector_filename = fname_without_ext + ".npy"
     vector_path = fetch_vectors(vector_filename)
     if not vector_path:
         return None
-    vectors = np.load(vector_path)
+    vectors = np.load(vector_path, mmap_mode="r", allow_pickle=False)
     if len(chunks) != len(vectors):
         return None
     return (chunks, vectors)
@@ -212,39 +357,24 @@ def remove_pdf_files(filename: str) -> dict:
     errors = []
 
     # Remove .pdf extension for text/vector file names
-    base_name = filename.replace(".pdf", "")
-
-    text_path = fetch_text(f"{base_name}.txt")
-    if text_path and os.path.exists(text_path):
+    base_name = os.path.splitext(filename)[0]
+
+    # One unlink per file: a missing file is reported from the unlink itself
+    # instead of stat-ing it first
+    for label, kind, directory, ext in (
+        ("text", "text", TEXT_STORAGE_DIR, ".txt"),
+        ("cleaned text", "cleaned text", CLEANED_TEXT_STORAGE_DIR, ".txt"),
+        ("vectors", "vector", VECTOR_STORAGE_DIR, ".npy"),
+    ):
+        path = os.path.join(directory, base_name + ext)
+        _STAT_CACHE.pop(path, None)
         try:
-            os.remove(text_path)
-            removed_files.append(f"text: {text_path}")
+            os.unlink(path)
+            removed_files.append(f"{label}: {path}")
+        except FileNotFoundError:
+            errors.append(f"{kind.capitalize()} file not found: {path}")
         except Exception as e:
-            errors.append(f"Failed to remove text file: {e}")
-    else:
-        errors.append("Text file not found: text_path")
-
-    # Remove cleaned text file
-    cleaned_text_path = fetch_cleaned_text(f"{base_name}.txt")
-    if cleaned_text_path and os.path.exists(cleaned_text_path):
-        try:
-            os.remove(cleaned_text_path)
-            removed_files.append(f"cleaned text: {cleaned_text_path}")
-        except Exception as e:
-            errors.append(f"Failed to remove cleaned text file: {e}")
-    else:
-        errors.append("Cleaned text file not found: cleaned_text_path")
-
-    # Remove vector file
-    vector_path = fetch_vectors(f"{base_name}.npy")
-    if vector_path and os.path.exists(vector_path):
-        try:
-            os.remove(vector_path)
-            removed_files.append(f"vectors: {vector_path}")
-        except Exception as e:
-            errors.append(f"Failed to remove vector file: {e}")
-    else:
-        errors.append("Vector file not found: vector_path")
+            errors.append(f"Failed to remove {kind} file: {e}")
 
     return {
         "success": len(errors) == 0,
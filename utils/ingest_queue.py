@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.db_utils import set_pool_max_conn
+from utils.vector_utils import extract_embed_n_save
+
+try:
+    from arq import create_pool
+    from arq.connections import RedisSettings
+except ImportError:
+    create_pool = None
+
+# Number of PDFs embedded concurrently (worker processes or arq jobs). The local
+# pool is per web worker, so under gunicorn up to WEB_CONCURRENCY * INGEST_WORKERS
+# ingest processes can run; use arq to bound ingest across the whole server
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Embedding threads per ingest process; defaults to the CPUs split between
+# INGEST_WORKERS rather than the web workers' EMBEDDING_NUM_THREADS
+INGEST_NUM_THREADS = int(
+    os.getenv("INGEST_NUM_THREADS", max(1, (os.cpu_count() or 1) // INGEST_WORKERS))
+)
+# DB connections per concurrent ingest job: the PDF insert plus one for the
+# org lookup / index check. gunicorn.conf.py reserves these out of
+# DB_MAX_CONNECTIONS, so ingest doesn't take the web workers' pool size
+INGEST_DB_POOL_MAX_CONN = int(os.getenv("INGEST_DB_POOL_MAX_CONN", "2"))
+# When set (and arq is installed), uploads are queued to a separate arq
+# worker: arq utils.ingest_queue.WorkerSettings
+REDIS_URL = os.getenv("REDIS_URL")
+
+_EXECUTOR = None
+_ARQ_POOL = None
+
+
+def _init_ingest_process(jobs: int = 1):
+    # Read by the Embedder when it loads; spawned children would otherwise
+    # inherit the web worker's thread count (and DB pool size)
+    os.environ["EMBEDDING_NUM_THREADS"] = str(INGEST_NUM_THREADS)
+    set_pool_max_conn(INGEST_DB_POOL_MAX_CONN * jobs)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        # spawn, not fork: the parent already has torch threads running
+        _EXECUTOR = ProcessPoolExecutor(
+            max_workers=INGEST_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_ingest_process,
+        )
+    return _EXECUTOR
+
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    """Drop a pool whose child died, so the next upload starts a fresh one."""
+    global _EXECUTOR
+    if _EXECUTOR is broken:
+        _EXECUTOR = None
+        broken.shutdown(wait=False)
+
+
+def _on_ingest_done(executor, future):
+    if future.exception() is not None:
+        print(f"ERROR!!! ingest failed: {future.exception()}")
+        if isinstance(future.exception(), BrokenProcessPool):
+            _reset_executor(executor)
+
+
+async def enqueue_ingest(pdf_path, chunk_size, model_name, pdf_filename):
+    """
+    Schedule extract_embed_n_save outside the web worker and return
+    immediately.
+
+    Goes to arq when REDIS_URL is configured, otherwise to a local pool of
+    INGEST_WORKERS processes, each holding its own embedder and DB pool.
+    """
+    global _ARQ_POOL
+    if REDIS_URL and create_pool is not None:
+        if _ARQ_POOL is None:
+            _ARQ_POOL = await create_pool(RedisSettings.from_dsn(REDIS_URL))
+        await _ARQ_POOL.enqueue_job(
+            "embed_pdf", pdf_path, chunk_size, model_name, pdf_filename
+        )
+        return
+    loop = asyncio.get_running_loop()
+    args = (extract_embed_n_save, pdf_path, chunk_size, model_name, pdf_filename)
+    executor = _get_executor()
+    try:
+        future = loop.run_in_executor(executor, *args)
+    except BrokenProcessPool:
+        # A child died since the last upload; its job is lost, this one isn't
+        _reset_executor(executor)
+        executor = _get_executor()
+        future = loop.run_in_executor(executor, *args)
+    future.add_done_callback(functools.partial(_on_ingest_done, executor))
+
+
+async def embed_pdf(ctx, pdf_path, chunk_size, model_name, pdf_filename):
+    """arq job: embedding is CPU/GPU bound, so run it off the worker's loop."""
+    await asyncio.to_thread(
+        extract_embed_n_save, pdf_path, chunk_size, model_name, pdf_filename
+    )
+
+
+if create_pool is not None:
+
+    async def _on_worker_startup(ctx):
+        # One arq worker process runs up to max_jobs ingests at once
+        _init_ingest_process(INGEST_WORKERS)
+
+    class WorkerSettings:
+        functions = [embed_pdf]
+        on_startup = _on_worker_startup
+        max_jobs = INGEST_WORKERS
+        job_timeout = 1800
+        redis_settings = RedisSettings.from_dsn(REDIS_URL or "redis://localhost:6379")
@@ -1,15 +1,50 @@
+import atexit
 import json
 import os
 
-import requests
+import httpx
 
 from utils import timeit
 
+try:
+    from orjson import dumps as json_dumps
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+
+try:
+    import h2  # noqa: F401  (httpx's optional HTTP/2 support)
+except ImportError:
+    h2 = None
+
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://0.0.0.0:11434")
 MODEL_NAME = os.getenv("MODEL_NAME", "llama-3.1-8b-instant")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
 print(MODEL_NAME)
 
+# Request headers are built once; GROQ_API_KEY is only read at import anyway
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_GROQ_HEADERS = {
+    "Authorization": f"Bearer {GROQ_API_KEY}",
+    "Content-Type": "application/json",
+}
+
+# Shared across requests so every call reuses keep-alive connections instead
+# of a new socket (and TLS handshake) per answer; with h2 installed, calls to
+# Groq are multiplexed over one HTTP/2 connection
+_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+_LIMITS = httpx.Limits(max_keepalive_connections=8)
+_ASYNC_CLIENT = httpx.AsyncClient(
+    http2=h2 is not None, timeout=_TIMEOUT, limits=_LIMITS
+)
+_CLIENT = httpx.Client(http2=h2 is not None, timeout=_TIMEOUT, limits=_LIMITS)
+atexit.register(_CLIENT.close)
+
 
 @timeit
 def generate_llm_answer(prompt: str, model_name: str = MODEL_NAME) -> str:
@@ -17,15 +52,12 @@ def generate_llm_answer(prompt: str, model_name: str = MODEL_NAME) -> str:
     Generate an LLM answer using the Groq API (OpenAI-compatible endpoint).
     Requires GROQ_API_KEY to be set in the environment.
     """
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
     payload = {"model": model_name, "messages": [{"role": "user", "content": prompt}]}
-    response = requests.post(url, headers=headers, json=payload)
+    response = _CLIENT.post(
+        GROQ_CHAT_URL, headers=_GROQ_HEADERS, content=json_dumps(payload)
+    )
     if response.status_code == 200:
-        data = response.json()
+        data = json_loads(response.content)
         # OpenAI format: choices[0].message.content
         return data["choices"][0]["message"]["content"].strip()
     else:
@@ -33,28 +65,48 @@ def generate_llm_answer(prompt: str, model_name: str = MODEL_NAME) -> str:
 
 
 @timeit
-def generate_llm_answer_local(prompt: str, model_name: str = MODEL_NAME) -> str:
-    response = requests.post(
-        f"{OLLAMA_URL}/api/generate",
-        json={"model": model_name, "prompt": prompt, "stream": True},
-        stream=True,
+async def generate_llm_answer_async(prompt: str, model_name: str = MODEL_NAME) -> str:
+    """
+    Async variant of generate_llm_answer, so async endpoints can keep serving
+    other requests while waiting on Groq.
+    """
+    payload = {"model": model_name, "messages": [{"role": "user", "content": prompt}]}
+    response = await _ASYNC_CLIENT.post(
+        GROQ_CHAT_URL, headers=_GROQ_HEADERS, content=json_dumps(payload)
     )
-    answer = ""
     if response.status_code == 200:
+        data = json_loads(response.content)
+        return data["choices"][0]["message"]["content"].strip()
+    else:
+        raise RuntimeError(f"Groq API error: {response.text}")
+
+
+@timeit
+def generate_llm_answer_local(prompt: str, model_name: str = MODEL_NAME) -> str:
+    with _CLIENT.stream(
+        "POST",
+        f"{OLLAMA_URL}/api/generate",
+        headers=_JSON_HEADERS,
+        content=json_dumps({"model": model_name, "prompt": prompt, "stream": True}),
+    ) as response:
+        if response.status_code != 200:
+            response.read()
+            raise RuntimeError(f"Ollama API error: {response.text}")
+        # Collect the streamed pieces and join once, instead of growing a str
+        parts = []
         for line in response.iter_lines():
             if not line:
                 continue
             try:
-                data = json.loads(line.decode("utf-8"))
-                if "response" in data:
-                    answer += data["response"]
-                if data.get("done"):
-                    break
-            except Exception:
+                data = json_loads(line)
+            except ValueError:
+                # Both orjson's and json's decode errors subclass ValueError
                 continue
-        return answer.strip()
-    else:
-        raise RuntimeError(f"Ollama API error: {response.text}")
+            if "response" in data:
+                parts.append(data["response"])
+            if data.get("done"):
+                break
+        return "".join(parts).strip()
 
 
 """
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+# Cosine similarity above which two questions are treated as the same question
+DEFAULT_SIMILARITY_THRESHOLD = 0.86
+DEFAULT_MAX_SIZE = 1024
+# Seconds a cached answer is served before the question is answered again
+DEFAULT_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+
+class SemanticCache:
+    """
+    In-memory cache of answers keyed by question embedding.
+
+    Past question embeddings are kept L2-normalized in one preallocated
+    (max_size, d) matrix, so a lookup is a single matrix-vector product plus
+    an argmax. When full, the least recently used entry is overwritten.
+
+    Each entry also carries an integer key (e.g. top_k) that must match
+    exactly, and entries expire after ttl seconds. The cache is per process,
+    so callers pass a generation read from the shared store with every
+    lookup: when it changes, every entry from the older generation is dropped.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: float = DEFAULT_TTL,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop every cached answer (e.g. after the PDF corpus changes)."""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._matrix = None
+        self._values = [None] * self.max_size
+        self._keys = np.zeros(self.max_size, dtype=np.int64)
+        self._stored_at = np.zeros(self.max_size, dtype=np.float64)
+        self._last_used = np.zeros(self.max_size, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+        self._generation = None
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            self._clear()
+            self._generation = generation
+
+    @staticmethod
+    def _normalize(q_vec) -> np.ndarray:
+        q = np.asarray(q_vec, dtype=np.float32)
+        return q / (np.linalg.norm(q) + 1e-8)
+
+    def get(self, q_vec, key: int = 0, generation=None) -> Optional[dict]:
+        """
+        Return the cached value for the most similar past question, if close
+        enough, stored under the same key and generation and not yet expired.
+        """
+        q = self._normalize(q_vec)
+        with self._lock:
+            self._check_generation(generation)
+            if not self._size:
+                return None
+            scores = self._matrix[: self._size] @ q
+            stale = (self._keys[: self._size] != key) | (
+                self._stored_at[: self._size] < time.monotonic() - self.ttl
+            )
+            scores[stale] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._clock += 1
+            self._last_used[best] = self._clock
+            return self._values[best]
+
+    def put(self, q_vec, value: dict, key: int = 0, generation=None):
+        """Store a value for a question embedding, evicting the LRU entry when full."""
+        q = self._normalize(q_vec)
+        with self._lock:
+            self._check_generation(generation)
+            if self._matrix is None:
+                self._matrix = np.empty((self.max_size, q.shape[0]), dtype=np.float32)
+            if self._size < self.max_size:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._clock += 1
+            self._matrix[slot] = q
+            self._values[slot] = value
+            self._keys[slot] = key
+            self._stored_at[slot] = time.monotonic()
+            self._last_used[slot] = self._clock
+
+
+# Shared cache for /v2/ask_ai answers
+ANSWER_CACHE = SemanticCache()
@@ -1,5 +1,42 @@
 import re
 import unicodedata
+from typing import List
+
+
+# Character ranges kept by clean_text; everything else is treated as a PDF artifact
+_ALLOWED_RANGES = (
+    (0x20, 0x7E),
+    (0xA0, 0xFF),
+    (0x100, 0x17F),
+    (0x180, 0x24F),
+    (0x1E00, 0x1EFF),
+    (0x2C60, 0x2C7F),
+    (0xA720, 0xA7FF),
+)
+
+# Patterns are compiled once at import rather than looked up on every call
+_CONTROL_AND_ZERO_WIDTH_RE = re.compile(r"[\x00-\x1F\x7F-\x9F\u200B-\u200D\uFEFF]")
+_BULLET_RE = re.compile(r"^[\s]*([\-\*•◦‣▪‣‣●○▪▫‣⁃])\s*", flags=re.MULTILINE)
+# Also covers the box drawing, arrow and card suit characters, which all fall
+# outside the allowed ranges
+_ARTIFACT_RE = re.compile(
+    r"[^\x20-\x7E\u00A0-\u00FF\u0100-\u017F\u0180-\u024F\u1E00-\u1EFF\u2C60-\u2C7F\uA720-\uA7FF]"
+)
+_WHITESPACE_RE = re.compile(r"\s+")
+# Characters of Unicode category C (e.g. soft hyphen, unassigned code points)
+# that survive the artifact filter
+_OTHER_CATEGORY_RE = re.compile(
+    "["
+    + "".join(
+        re.escape(chr(cp))
+        for start, stop in _ALLOWED_RANGES
+        for cp in range(start, stop + 1)
+        if unicodedata.category(chr(cp))[0] == "C"
+    )
+    + "]"
+)
+_NON_ASCII_RE = re.compile(r"[^\x20-\x7E]")
+_PUNCTUATION_RE = re.compile(r"[^\w\s\.\,\!\?\;\:\-\(\)\[\]\{\}]")
 
 
 class TextCleaner:
@@ -20,38 +57,25 @@ class TextCleaner:
         # Normalize Unicode characters (NFKC normalizes and composes characters)
         text = unicodedata.normalize("NFKC", text)
 
-        # Remove non-printable/control characters (including extended ASCII control chars)
-        text = re.sub(r"[\x00-\x1F\x7F-\x9F]", "", text)
-
-        # Remove zero-width characters and other invisible Unicode
-        text = re.sub(r"[\u200B-\u200D\uFEFF]", "", text)
+        # Remove non-printable/control characters (including extended ASCII
+        # control chars), zero-width characters and other invisible Unicode
+        text = _CONTROL_AND_ZERO_WIDTH_RE.sub("", text)
 
         # Remove common bullet points and list markers at the start of lines
-        text = re.sub(r"^[\s]*([\-\*•◦‣▪‣‣●○▪▫‣⁃])\s*", "", text, flags=re.MULTILINE)
-
-        # Remove common PDF artifacts and formatting characters
-        text = re.sub(r"[■□▪▫▬▭▮▯▰▱]", "", text)  # Box drawing characters
-        text = re.sub(r"[←↑→↓↔↕↖↗↘↙]", "", text)  # Arrow characters
-        text = re.sub(r"[♠♣♥♦]", "", text)  # Card suit characters
+        text = _BULLET_RE.sub("", text)
 
         # Remove common PDF text artifacts
-        text = re.sub(
-            r"[^\x20-\x7E\u00A0-\u00FF\u0100-\u017F\u0180-\u024F\u1E00-\u1EFF\u2C60-\u2C7F\uA720-\uA7FF]",
-            "",
-            text,
-        )
+        text = _ARTIFACT_RE.sub("", text)
 
-        # Normalize whitespace (multiple spaces, tabs, newlines)
-        text = re.sub(r"\s+", " ", text)
+        # Normalize whitespace (multiple spaces, tabs, newlines); this also
+        # leaves no line breaks behind
+        text = _WHITESPACE_RE.sub(" ", text)
 
         # Remove leading/trailing whitespace
         text = text.strip()
 
-        # Remove empty lines and excessive line breaks
-        text = re.sub(r"\n\s*\n", "\n", text)
-
         # Final cleanup - remove any remaining control characters
-        text = "".join(char for char in text if unicodedata.category(char)[0] != "C")
+        text = _OTHER_CATEGORY_RE.sub("", text)
 
         return text
 
@@ -69,13 +93,24 @@ class TextCleaner:
         text = TextCleaner.clean_text(text)
 
         # Remove any remaining non-ASCII characters (more aggressive)
-        text = re.sub(r"[^\x20-\x7E]", " ", text)
+        text = _NON_ASCII_RE.sub(" ", text)
 
         # Remove excessive punctuation
-        text = re.sub(r"[^\w\s\.\,\!\?\;\:\-\(\)\[\]\{\}]", " ", text)
+        text = _PUNCTUATION_RE.sub(" ", text)
 
         # Normalize whitespace again
-        text = re.sub(r"\s+", " ", text)
+        text = _WHITESPACE_RE.sub(" ", text)
         text = text.strip()
 
         return text
+
+    @staticmethod
+    def clean_batch(texts: List[str]) -> List[str]:
+        """
+        Aggressively clean a batch of texts.
+        Args:
+            texts (List[str]): Raw chunk texts.
+        Returns:
+            List[str]: Cleaned texts, in input order.
+        """
+        return [TextCleaner.clean_text_aggressive(text) for text in texts]
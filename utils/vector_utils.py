@@ -1,17 +1,20 @@
-import concurrent.futures
 import os
+import platform
+import queue
+import threading
 import time
-from typing import List, Optional
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-from utils import timeit
+from utils import TIMEIT_ENABLED, timeit
 from utils.db_utils import (
-    bulk_insert_chunks_with_embeddings_copy,
+    ensure_embedding_index,
     get_or_create_org,
-    insert_pdf,
+    insert_pdf_with_chunks,
 )
+from utils.embedding_cache import EMBEDDING_CACHE, chunk_key
 from utils.file_manager import (
     advanced_chunk_text,
     extract_text_from_pdf,
@@ -21,105 +24,297 @@ from utils.file_manager import (
 )
 from utils.text_cleaner import TextCleaner
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 # Default embedding model and size (can be changed later)
 DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 SAVE_TO_DB = True
+# Fixed encode batch size used at ingest time (chunks are length-sorted first)
+INGEST_BATCH_SIZE = 1024
+GPU_INGEST_BATCH_SIZE = 256
+# Set EMBEDDING_DEVICE=cpu on CPU-only deployments to skip probing CUDA at all
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE")
+# "onnx" runs the model through ONNX Runtime, "torch" keeps the PyTorch path (A/B)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+# Opt-in torch.compile of the GPU (torch backend) model; compilation adds
+# startup time, so it is off by default
+EMBEDDING_TORCH_COMPILE = os.getenv("EMBEDDING_TORCH_COMPILE", "0") == "1"
+
+
+def _default_onnx_model_file() -> str:
+    """
+    Pick the int8 dynamically quantized export (shipped with the
+    sentence-transformers models) built for this CPU's integer dot-product
+    instructions: AVX512-VNNI > AVX512 > AVX2, or the ARM64 one.
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        flags = ""
+    if "avx512_vnni" in flags:
+        return "onnx/model_qint8_avx512_vnni.onnx"
+    if "avx512bw" in flags:
+        return "onnx/model_qint8_avx512.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE") or _default_onnx_model_file()
 
 
-# OLD SentenceTransformer Implementation (commented out)
-# class Embedder:
-#     def __init__(self, model_name: Optional[str] = None):
-#         self.model_name = model_name or DEFAULT_EMBEDDING_MODEL
-#         self.model = SentenceTransformer(self.model_name)
-#
-#     def embed(self, texts: List[str]) -> List[List[float]]:
-#         return self.model.encode(texts, show_progress_bar=False).tolist()
-
-
-# NEW SentenceTransformer Implementation with Async Processing
 class Embedder:
     @timeit
     def __init__(self, model_name: Optional[str] = None):
         try:
+            # Imported here: they pull in transformers (and onnxruntime), which
+            # callers that only score vectors never need
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            num_threads = int(os.getenv("EMBEDDING_NUM_THREADS", os.cpu_count() or 1))
+            torch.set_num_threads(num_threads)
             self.model_name = model_name or DEFAULT_EMBEDDING_MODEL
-            self.model = SentenceTransformer(self.model_name)
-            print(f"SentenceTransformer model '{self.model_name}' loaded successfully")
+            self.device = EMBEDDING_DEVICE or (
+                "cuda" if torch.cuda.is_available() else "cpu"
+            )
+            # The int8 ONNX export is a CPU optimization; on GPU run torch directly
+            self.backend = EMBEDDING_BACKEND if self.device == "cpu" else "torch"
+            if self.backend == "onnx":
+                try:
+                    import onnxruntime
+
+                    # ONNX Runtime sizes its own intra-op pool to every core
+                    # unless told otherwise; torch's setting doesn't reach it
+                    session_options = onnxruntime.SessionOptions()
+                    session_options.intra_op_num_threads = num_threads
+                    self.model = SentenceTransformer(
+                        self.model_name,
+                        backend="onnx",
+                        model_kwargs={
+                            "file_name": ONNX_MODEL_FILE,
+                            "session_options": session_options,
+                        },
+                    )
+                except Exception as e:
+                    print(f"ONNX backend unavailable, falling back to torch: {e}")
+                    self.backend = "torch"
+            if self.backend != "onnx":
+                self.model = SentenceTransformer(self.model_name, device=self.device)
+                if self.device.startswith("cuda"):
+                    # fp16 weights halve memory traffic per forward pass on GPU
+                    self.model.half()
+                    if EMBEDDING_TORCH_COMPILE:
+                        self._compile()
+            # One throwaway encode so lazy session/kernel setup happens at load
+            # time, not on the first real request
+            self.model.encode(["warm up"], show_progress_bar=False)
+            print(
+                f"SentenceTransformer model '{self.model_name}' loaded successfully ({self.backend}, {self.device})"
+            )
         except ImportError:
             raise ImportError(
                 "SentenceTransformers not installed. Install with: pip install sentence-transformers"
             )
 
-    @timeit
-    def embed(self, texts: List[str]) -> List[List[float]]:
+    def _compile(self):
+        """
+        torch.compile the transformer behind the first SentenceTransformer
+        module (fused kernels, fewer launches). Compiled with dynamic shapes,
+        since every batch pads to a different length, and warmed up here so
+        the first real request doesn't pay for compilation.
+        """
+        import torch
+
+        module = self.model._first_module()
+        eager = module.auto_model
+        try:
+            module.auto_model = torch.compile(eager, dynamic=True)
+            self.model.encode(["warm up"], show_progress_bar=False)
+        except Exception as e:
+            print(f"torch.compile unavailable, running eager: {e}")
+            module.auto_model = eager
+
+    def embed(
+        self, texts: List[str], return_numpy: bool = True, batch_size: int = 64
+    ):
         """
         Generate embeddings using SentenceTransformers.
 
         Args:
             texts: List of text strings to embed
+            return_numpy: Return one (N, d) float32 array instead of lists
+            batch_size: Number of texts per forward pass
 
         Returns:
-            List of embedding vectors as lists of floats
+            (N, d) float32 array, or list of embedding vectors as lists of floats
         """
-        # SentenceTransformers returns numpy arrays, convert to lists
-        embeddings = self.model.encode(texts, show_progress_bar=False)
-        # Convert numpy arrays to lists of floats for compatibility
-        return [embedding.tolist() for embedding in embeddings]
-
-    @timeit
-    def embed_async(self, texts: List[str]) -> List[List[float]]:
+        # Normalized so pgvector's inner-product index ranks like cosine
+        embeddings = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32, copy=False)
+        if return_numpy:
+            return embeddings
+        return embeddings.tolist()
+
+    def embed_corpus(
+        self, texts: List[str], batch_size: Optional[int] = None, verbose: bool = True
+    ) -> np.ndarray:
         """
-        Generate embeddings asynchronously with smart batching.
+        Embed all chunks of a document. Chunks repeated verbatim (headers,
+        footers, boilerplate) are encoded once, and chunks already in the
+        persistent embedding cache aren't encoded at all.
 
         Args:
             texts: List of text strings to embed
+            batch_size: Number of texts per forward pass (defaults per device)
+            verbose: Print the chunk counts and timing; off for callers that
+                embed many small batches
 
         Returns:
-            List of embedding vectors as lists of floats
+            (N, d) float32 array of L2-normalized embeddings, in input order
         """
-        # Small inputs: use single thread (no overhead)
-        if len(texts) < 10:
-            return self.embed(texts)
-
-        # Large inputs: use parallel processing with threads (can share model)
-        batch_size = max(50, len(texts) // (os.cpu_count() or 4))
-        print(
-            f"Processing {len(texts)} texts in batches of {batch_size} using parallel processing"
-        )
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            batches = [
-                texts[i : i + batch_size] for i in range(0, len(texts), batch_size)
-            ]
-            futures = [executor.submit(self._embed_batch, batch) for batch in batches]
-            results = [future.result() for future in futures]
-        return [emb for batch in results for emb in batch]
-
-    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        start_time = time.time()
+        dim = self.model.get_sentence_embedding_dimension()
+        vectors = np.empty((len(texts), dim), dtype=np.float32)
+        for rows, batch in self.iter_embed_corpus(texts, batch_size, verbose):
+            vectors[rows] = batch
+        if verbose and TIMEIT_ENABLED:
+            print(f"embed_corpus took {time.time() - start_time:.2f} seconds")
+        return vectors
+
+    def iter_embed_corpus(
+        self, texts: List[str], batch_size: Optional[int] = None, verbose: bool = True
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
         """
-        Embed a batch of texts (used by ThreadPoolExecutor).
+        Generator form of embed_corpus that hands rows out as soon as they're
+        ready: first every row served from the cache, then one group per
+        encoded batch, so a consumer can work on early rows while later
+        batches are still encoding.
 
         Args:
             texts: List of text strings to embed
+            batch_size: Number of texts per forward pass (defaults per device)
+            verbose: Print how many chunks need encoding
 
-        Returns:
-            List of embedding vectors as lists of floats
+        Yields:
+            (row indices, (len(indices), d) float32 array) pairs, covering
+            every input row exactly once
         """
-        # Can use self.model directly since we're using threads
-        embeddings = self.model.encode(texts, show_progress_bar=False)
-        return [emb.tolist() for emb in embeddings]
+        if not texts:
+            return
+        dim = self.model.get_sentence_embedding_dimension()
+        # Map every chunk to the index of its first identical occurrence
+        first = {}
+        inverse = np.empty(len(texts), dtype=np.intp)
+        unique_texts = []
+        for i, text in enumerate(texts):
+            key = chunk_key(text)
+            j = first.get(key)
+            if j is None:
+                j = first[key] = len(unique_texts)
+                unique_texts.append(text)
+            inverse[i] = j
+        unique_keys = list(first)
+
+        cache_model = f"{self.model_name}:{self.backend}:{self.device}"
+        if self.backend == "onnx":
+            # Each quantized export yields slightly different vectors
+            cache_model += f":{ONNX_MODEL_FILE}"
+        elif self.device.startswith("cuda"):
+            # GPU weights are halved in __init__
+            cache_model += ":fp16"
+        cached = EMBEDDING_CACHE.get_many(cache_model, unique_keys)
+        unique_vectors = np.empty((len(unique_keys), dim), dtype=np.float32)
+        ready = np.zeros(len(unique_keys), dtype=bool)
+        missing = []
+        for j, key in enumerate(unique_keys):
+            vec = cached.get(key)
+            if vec is None:
+                missing.append(j)
+            else:
+                unique_vectors[j] = vec
+                ready[j] = True
+        if verbose:
+            print(
+                f"Embedding {len(missing)} of {len(texts)} chunks ({len(unique_keys)} unique, {len(cached)} cached)"
+            )
+        if cached:
+            rows = np.flatnonzero(ready[inverse])
+            yield rows, unique_vectors[inverse[rows]]
+
+        if batch_size is None:
+            batch_size = (
+                INGEST_BATCH_SIZE if self.device == "cpu" else GPU_INGEST_BATCH_SIZE
+            )
+        # Length-sorted before slicing, so every batch pads to similar lengths
+        missing.sort(key=lambda j: len(unique_texts[j]))
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            encoded = self._encode_sorted([unique_texts[j] for j in batch], batch_size)
+            unique_vectors[batch] = encoded
+            EMBEDDING_CACHE.put_many(
+                cache_model, [unique_keys[j] for j in batch], encoded
+            )
+            ready[:] = False
+            ready[batch] = True
+            rows = np.flatnonzero(ready[inverse])
+            yield rows, unique_vectors[inverse[rows]]
+
+    def _encode_sorted(
+        self, texts: List[str], batch_size: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Encode texts sorted by length so each batch pads to similar sequence
+        lengths. Embeddings stay torch tensors (on the device, when on GPU)
+        for the whole encode and are converted to NumPy exactly once.
+        """
+        if batch_size is None:
+            batch_size = (
+                INGEST_BATCH_SIZE if self.device == "cpu" else GPU_INGEST_BATCH_SIZE
+            )
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        encoded = self.model.encode(
+            [texts[i] for i in order],
+            batch_size=batch_size,
+            show_progress_bar=False,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+        )
+        encoded = encoded.cpu().numpy().astype(np.float32, copy=False)
+        # Scatter back so row i is the embedding of texts[i]
+        vectors = np.empty(encoded.shape, dtype=np.float32)
+        vectors[order] = encoded
+        return vectors
+
+
+# Model get_embedder() returns when no name is given: the last one requested
+EMBEDDING_MODEL = DEFAULT_EMBEDDING_MODEL
+_EMBEDDER_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=4)
+def _load_embedder(model_name: str) -> Embedder:
+    # Keeps a few models resident, so switching back to one doesn't reload
+    # its weights from disk
+    return Embedder(model_name=model_name)
 
 
-@timeit
 def get_embedder(model_name: Optional[str] = None):
-    global EMBEDDER, EMBEDDING_MODEL
-    if (
-        "EMBEDDER" not in globals()
-        or EMBEDDER is None
-        or (model_name and model_name != EMBEDDING_MODEL)
-    ):
-        globals()["EMBEDDER"] = Embedder(model_name=model_name)
-        globals()["EMBEDDING_MODEL"] = globals()["EMBEDDER"].model_name
-    return globals()["EMBEDDER"]
+    global EMBEDDING_MODEL
+    # Serialized so concurrent first requests load a model only once
+    with _EMBEDDER_LOCK:
+        if model_name:
+            EMBEDDING_MODEL = model_name
+        return _load_embedder(EMBEDDING_MODEL)
 
 
 @timeit
@@ -143,56 +338,177 @@ def extract_embed_n_save(pdf_path, chunk_size, model_name, pdf_filename):
 
     # Embed and store vectors using cleaned chunks
     embedder = get_embedder(model_name)
-    vectors = embedder.embed_async(chunks)
     vector_filename = fname_without_ext + ".npy"
-    store_vectors(vectors, vector_filename)
+    if SAVE_TO_DB:
+        # Each batch is COPY'd into the DB as soon as it's encoded, so the
+        # insert's network I/O overlaps the encode of the batches after it
+        pipeline = _EmbeddingPipeline(embedder, chunks)
+        try:
+            _save_rows_in_db(pdf_filename, chunk_size, pipeline.rows())
+        finally:
+            # Also reached when the DB insert fails: the vector file is still
+            # written once the remaining batches are encoded
+            store_vectors(pipeline.wait(), vector_filename)
+    else:
+        store_vectors(embedder.embed_corpus(chunks), vector_filename)
 
     print(
         f"Saved raw text to {text_filename}, cleaned text to {cleaned_text_filename}, and vectors to {vector_filename}"
     )
     print(f"Generated {len(chunks)} cleaned chunks from {len(chunks)} original chunks")
 
-    if SAVE_TO_DB:
-        save_in_db(pdf_filename, chunk_size, chunks, vectors)
 
+class _EmbeddingPipeline:
+    """
+    Runs Embedder.iter_embed_corpus on a background thread, filling one (N, d)
+    array in place. rows() yields (chunk_index, text, embedding) for the
+    non-blank chunks as each batch lands; encoding releases the GIL, so
+    whatever consumes them (the DB COPY) overlaps its I/O with the next
+    batch's encode.
+    """
+
+    _DONE = object()
+
+    def __init__(self, embedder: Embedder, chunks: List[str]):
+        self.chunks = chunks
+        dim = embedder.model.get_sentence_embedding_dimension()
+        self.vectors = np.empty((len(chunks), dim), dtype=np.float32)
+        # Bounded, so encoding never runs far ahead of a stalled consumer
+        self._batches = queue.Queue(maxsize=2)
+        self._finished = False
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._produce, args=(embedder,), daemon=True
+        )
+        self._thread.start()
 
-@timeit
-def save_in_db(pdf_filename, chunk_size, chunks, vectors):
+    def _produce(self, embedder: Embedder):
+        try:
+            for rows, batch in embedder.iter_embed_corpus(self.chunks):
+                self.vectors[rows] = batch
+                self._batches.put(rows)
+            self._batches.put(self._DONE)
+        except BaseException as e:
+            self._batches.put(e)
+
+    def _next_batch(self) -> Optional[np.ndarray]:
+        item = self._batches.get()
+        if item is self._DONE:
+            self._finished = True
+            return None
+        if isinstance(item, BaseException):
+            self._finished = True
+            self._error = item
+            raise item
+        return item
+
+    def rows(self):
+        while not self._finished:
+            rows = self._next_batch()
+            if rows is None:
+                return
+            for i in rows.tolist():
+                if self.chunks[i].strip():
+                    yield i, self.chunks[i], self.vectors[i]
+
+    def wait(self) -> np.ndarray:
+        """Encode whatever the consumer didn't read and return the full array."""
+        while not self._finished:
+            self._next_batch()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.vectors
+
+
+def _save_rows_in_db(pdf_filename, chunk_size, chunks_data):
+    """Insert the PDF and stream its (chunk_index, text, embedding) rows."""
     print(f"Saving {pdf_filename} to db")
     org_id = get_or_create_org("default")
-    pdf_id = insert_pdf(org_id, pdf_filename, chunk_size)
+    if org_id is None:
+        print(f"Error: org 'default' is inactive, not saving {pdf_filename}")
+        return
+
+    saved = 0
 
-    # Prepare data for bulk insert
-    chunks_data = []
-    for idx, (chunk, vector) in enumerate(zip(chunks, vectors)):
-        # Final safety check - clean the chunk one more time before saving
-        if chunk.strip():  # Only save non-empty chunks
-            chunks_data.append((idx, chunk, vector))
+    def counted():
+        nonlocal saved
+        for row in chunks_data:
+            saved += 1
+            yield row
 
-    # Bulk insert all chunks with embeddings in one operation
+    # Insert the PDF row and all chunks with embeddings in one transaction
     start_time = time.time()
-    success = bulk_insert_chunks_with_embeddings_copy(pdf_id, chunks_data)
+    pdf_id = insert_pdf_with_chunks(org_id, pdf_filename, chunk_size, counted())
     end_time = time.time()
 
-    if success:
-        print(
-            f"Bulk inserted {len(chunks_data)} chunks in {end_time - start_time:.2f} seconds"
-        )
-        print(f"Saved {pdf_filename} to db with {len(chunks_data)} cleaned chunks")
+    if pdf_id is not None:
+        print(f"Bulk inserted {saved} chunks in {end_time - start_time:.2f} seconds")
+        print(f"Saved {pdf_filename} to db with {saved} cleaned chunks")
+        # No-op once the index exists; the first load builds it in bulk
+        ensure_embedding_index()
     else:
         print(f"Error: Failed to bulk insert chunks for {pdf_filename}")
 
 
 def cosine_sim(a: List[float], b: List[float]) -> float:
-    a = np.array(a)
-    b = np.array(b)
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-8))
+    # asarray: no copy for float32 arrays; one sqrt of the two squared norms
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return float(np.dot(a, b) / (np.sqrt(np.vdot(a, a) * np.vdot(b, b)) + 1e-8))
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_rows(matrix, query, out):
+        for i in prange(matrix.shape[0]):
+            s = 0.0
+            for d in range(matrix.shape[1]):
+                s += matrix[i, d] * query[d]
+            out[i] = s
+
+
+def cosine_sim_batch(
+    query, matrix: np.ndarray, norms: Optional[np.ndarray] = None, out=None
+) -> np.ndarray:
+    """
+    Cosine similarity of one query against every row of an (N, d) matrix.
+
+    Args:
+        query: Query vector of length d
+        matrix: (N, d) float32, float16 or int8 matrix of stored vectors
+        norms: Precomputed row norms, or None if rows are already unit-norm
+        out: Optional preallocated float32 buffer of length N for the scores
+
+    Returns:
+        (N,) float32 array of scores (``out`` when given)
+    """
+    q = np.asarray(query, dtype=np.float32)
+    if out is None:
+        out = np.empty(matrix.shape[0], dtype=np.float32)
+    # Numba threads over rows when installed (it has no float16 support);
+    # otherwise one BLAS matmul
+    if njit is not None and matrix.dtype != np.float16:
+        _dot_rows(matrix, q, out)
+    else:
+        np.matmul(matrix, q, out=out)
+    out /= np.linalg.norm(q) + 1e-8
+    if norms is not None:
+        out /= norms + 1e-8
+    return out
 
 
-@timeit
 def get_top_k_indices(scores: List[float], k: int) -> List[int]:
-    arr = np.array(scores)
-    return arr.argsort()[-k:][::-1].tolist()
+    # No copy for the float32 buffers cosine_sim_batch returns; lists don't
+    # get widened to float64
+    arr = np.asarray(scores, dtype=np.float32)
+    k = min(k, arr.size)
+    if k <= 0:
+        return []
+    # O(N) selection of the top k, then sort only those k
+    idx = np.argpartition(-arr, k - 1)[:k]
+    return idx[np.argsort(-arr[idx])].tolist()
 
 
 # Usage: